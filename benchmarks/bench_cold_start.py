@@ -0,0 +1,130 @@
+"""Benchmark du démarrage à froid : délai avant le premier affichage utile, dans un processus neuf.
+
+Chaque mesure lance un interpréteur neuf (imports de l'application compris, streamlit excepté)
+et exécute `universal_crm.py` via `streamlit.testing.v1.AppTest` sur une base SQLite synthétique :
+
+- `connexion` : page de connexion, puis envoi du formulaire jusqu'à l'affichage de l'application ;
+- `retour` : utilisateur de retour, session restaurée depuis le cookie `crm_session`.
+
+Le composant cookies ne tourne pas en headless : ses valeurs sont injectées dans
+`extra_streamlit_components.CookieManager`.
+
+    python benchmarks/bench_cold_start.py [--runs 5] [--records 10000] [--app chemin/universal_crm.py]
+
+Pour comparer avec une version antérieure :
+
+    git worktree add /tmp/crm_avant <commit> && python benchmarks/bench_cold_start.py --app /tmp/crm_avant/universal_crm.py
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP = os.path.join(ROOT, "universal_crm.py")
+EMAIL = "admin1@bench.local"
+
+
+def logged_in(at):
+    return "user" in at.session_state and bool(at.session_state["user"])
+
+
+def child(app, cookies, login):
+    """Une mesure, dans ce processus neuf ; écrit le résultat en JSON sur la sortie standard."""
+    import streamlit  # hors mesure : chargé par le serveur avant toute session
+    import extra_streamlit_components as stx
+    from streamlit.testing.v1 import AppTest
+
+    class Cookies:
+        def __init__(self, key="init"):
+            self.cookies = dict(cookies)
+
+        def get(self, cookie):
+            return self.cookies.get(cookie)
+
+        def get_all(self, key="get_all"):
+            return self.cookies
+
+        def set(self, cookie, val, key="set", **kwargs):
+            self.cookies[cookie] = val
+
+        def delete(self, cookie, key="delete"):
+            self.cookies.pop(cookie, None)
+
+    stx.CookieManager = Cookies
+    sys.path.insert(0, os.path.dirname(os.path.abspath(app)))
+    at = AppTest.from_file(app, default_timeout=120)
+    t0 = time.perf_counter()
+    at.run()
+    out = {"first_ms": (time.perf_counter() - t0) * 1000}
+    if login and not logged_in(at):
+        at.text_input[0].input(EMAIL)
+        at.text_input[1].input("bench")
+        t1 = time.perf_counter()
+        at.button[0].click().run()
+        out["login_ms"] = (time.perf_counter() - t1) * 1000
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    out["logged_in"] = logged_in(at)
+    out["total_ms"] = out["first_ms"] + out.get("login_ms", 0.0)
+    out["modules"] = len(sys.modules)
+    print(json.dumps(out))
+
+
+def measure(app, env, cookies, login):
+    res = subprocess.run([sys.executable, __file__, "--child", app, json.dumps(cookies), str(int(login))],
+                         env=env, capture_output=True, text=True, check=False)
+    if res.returncode:
+        raise RuntimeError(res.stderr.strip().splitlines()[-1] if res.stderr.strip() else "échec")
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def report(name, runs):
+    print(f"{name:<12}{statistics.median(r['first_ms'] for r in runs):12.1f}"
+          f"{statistics.median(r.get('login_ms', 0.0) for r in runs):12.1f}"
+          f"{statistics.median(r['total_ms'] for r in runs):12.1f}{runs[-1]['modules']:10d}"
+          f"{'  oui' if all(r['logged_in'] for r in runs) else '  non':>10}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(sys.argv[2], json.loads(sys.argv[3]), sys.argv[4] == "1")
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5, help="processus par scénario")
+    ap.add_argument("--records", type=int, default=10000)
+    ap.add_argument("--app", default=APP)
+    args = ap.parse_args()
+
+    from bench_reruns import seed
+    from crm.data import SQLiteBackend
+
+    tmp = tempfile.mkdtemp(prefix="crm_bench_cold_")
+    try:
+        path, storage = os.path.join(tmp, "crm.db"), os.path.join(tmp, "storage")
+        seed(path, storage, args.records)
+        env = dict(os.environ, CRM_BACKEND="sqlite", CRM_SQLITE_PATH=path, CRM_STORAGE_DIR=storage,
+                   CRM_JOBS_DB=os.path.join(tmp, "jobs.db"), CRM_JOBS_DIR=tmp, CRM_JOBS_THREADS="0")
+        print(f"{args.app} — {args.records} dossiers, médiane de {args.runs} processus")
+        print(f"{'scénario':<12}{'1er rendu':>12}{'connexion':>12}{'total ms':>12}{'modules':>10}{'connecté':>10}")
+        # Cookie quelconque : le navigateur a déjà répondu, sans session enregistrée
+        report("connexion", [measure(args.app, env, {"_xsrf": "bench"}, True) for _ in range(args.runs)])
+        runs = []
+        for _ in range(args.runs):
+            db = SQLiteBackend(path, storage)
+            _, session = db.sign_in(EMAIL, "bench")  # un refresh token par mesure : il est à usage unique
+            db.con.close()
+            runs.append(measure(args.app, env, {"crm_session": session.refresh_token}, True))
+        report("retour", runs)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark du moteur de fusion PDF sur un dossier synthétique servi en HTTP local.
+
+Par défaut : 200 pages au total dont 50 images (photos 4000x3000), le reste réparti
+dans des PDF de 10 pages. Un serveur HTTP local simule la latence du stockage.
+
+    python benchmarks/bench_pdf_merge.py [--pages 200] [--images 50] [--latency-ms 40]
+
+Compare l'ancienne fusion séquentielle (requests.get sans pool, images pleine
+résolution) au moteur `crm.pdf.PdfMergeEngine` à froid puis depuis le cache.
+"""
+import argparse
+import functools
+import io
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+
+from crm.pdf import PdfMergeEngine
+
+
+def build_dossier(root, pages, images, pages_per_pdf=10):
+    names = []
+    for i in range(images):
+        img = Image.effect_noise((4000, 3000), 40).convert("RGB")
+        name = f"photo_{i:03d}.jpg"
+        img.save(os.path.join(root, name), quality=92)
+        names.append(name)
+    pdf_pages = max(pages - images, 0)
+    for i in range(0, pdf_pages, pages_per_pdf):
+        w = PdfWriter()
+        for _ in range(min(pages_per_pdf, pdf_pages - i)): w.add_blank_page(595, 842)
+        name = f"piece_{i // pages_per_pdf:03d}.pdf"
+        with open(os.path.join(root, name), "wb") as fh: w.write(fh)
+        names.append(name)
+    return names
+
+
+class SlowHandler(SimpleHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(root, latency):
+    SlowHandler.latency = latency
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(SlowHandler, directory=root))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def legacy_merge(urls):
+    """Reproduction de l'ancienne implémentation (référence)."""
+    merger = PdfWriter()
+    for url in urls:
+        res = requests.get(url)
+        f_data = io.BytesIO(res.content)
+        if url.endswith(".pdf"):
+            for page in PdfReader(f_data).pages: merger.add_page(page)
+        else:
+            img = Image.open(f_data).convert("RGB")
+            img_pdf = io.BytesIO()
+            img.save(img_pdf, format="PDF")
+            img_pdf.seek(0)
+            merger.add_page(PdfReader(img_pdf).pages[0])
+    out = io.BytesIO()
+    merger.write(out)
+    return out.getvalue()
+
+
+def timed(label, fn):
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    size = fn()
+    dt = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{label:<28} {dt:8.2f} s   {size / 1e6:8.1f} Mo   pic RSS +{(rss - rss0) / 1024:7.0f} Mo")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=200)
+    ap.add_argument("--images", type=int, default=50)
+    ap.add_argument("--latency-ms", type=float, default=40)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--dpi", type=int, default=150)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    root = tempfile.mkdtemp(prefix="crm_bench_src_")
+    cache = tempfile.mkdtemp(prefix="crm_bench_cache_")
+    try:
+        print(f"Génération de {args.pages} pages dont {args.images} images...")
+        names = build_dossier(root, args.pages, args.images)
+        httpd = serve(root, args.latency_ms / 1000)
+        base = f"http://127.0.0.1:{httpd.server_address[1]}"
+        urls = [f"{base}/{n}" for n in names]
+
+        engine = PdfMergeEngine(max_workers=args.workers, image_dpi=args.dpi, cache_dir=cache)
+        # Le RSS de pointe ne redescend jamais : l'ancienne fusion, la plus gourmande, passe en dernier
+        timed(f"moteur à froid ({args.dpi} dpi)", lambda: os.path.getsize(engine.merge_to_file(urls)[0]))
+        timed("moteur depuis le cache", lambda: os.path.getsize(engine.merge_to_file(urls)[0]))
+        if not args.skip_legacy:
+            timed("ancienne fusion séquentielle", lambda: len(legacy_merge(urls)))
+        httpd.shutdown()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(cache, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark des reruns de l'application sur le backend SQLite local.
+
+Une base synthétique (2 entreprises, 3 activités et 6 modèles par entreprise) est générée
+pour chaque volume de dossiers, puis `universal_crm.py` est exécuté en headless via
+`streamlit.testing.v1.AppTest`, connecté en admin1.
+
+    python benchmarks/bench_reruns.py [--records 1000 10000 100000] [--runs 10]
+
+Pour chaque volume et chaque vue : rerun à froid (nouvelle session, caches vides) puis
+reruns à chaud, avec la durée totale, le nombre d'appels backend, et le détail par
+section et par table.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from crm import metrics
+from crm.data import SQLiteBackend
+
+APP = os.path.join(ROOT, "universal_crm.py")
+FIELDS = [
+    {"name": "nom", "type": "Texte Court"},
+    {"name": "SIRET", "type": "SIRET"},
+    {"name": "Adresse", "type": "Adresse"},
+    {"name": "Ville", "type": "Texte Court"},
+    {"name": "Notes", "type": "Texte Long"},
+    {"name": "Photos", "type": "Fichier/Image"},
+]
+VIEWS = ["1. 📝 Nouveau Dossier", "2. 📂 Gestion des Dossiers", "3. ⚙️ Configuration", "4. 👥 Utilisateurs"]
+VILLES = ["Lyon", "Paris", "Nantes", "Lille", "Bordeaux", "Marseille"]
+
+
+def seed(path, storage, records, companies=2, activities=3, models=2, chunk=5000):
+    """Base synthétique ; renvoie le profil admin1 de la première entreprise."""
+    db = SQLiteBackend(path, storage)
+    col_ids = {}
+    for c in range(1, companies + 1):
+        db.con.execute("INSERT INTO companies (id, name) VALUES (?, ?)", (c, f"Entreprise {c}"))
+        db.add_profile({"id": f"admin-{c}", "email": f"admin{c}@bench.local", "company_id": c, "role": "admin1", "full_name": f"Admin {c}"})
+        for u in range(5):
+            db.add_profile({"id": f"user-{c}-{u}", "email": f"user{u}.{c}@bench.local", "company_id": c, "role": "user", "full_name": f"User {u}"})
+        for a in range(activities):
+            db.add_activity(c, f"Activité {c}.{a}")
+        for act in db.list_activities(c):
+            for m in range(models):
+                db.add_collection(act["id"], f"Modèle {m}", FIELDS)
+        col_ids[c] = [x["id"] for x in db.list_collections([a["id"] for a in db.list_activities(c)])]
+    db.con.commit()
+    rnd = random.Random(42)
+    all_cols = [cid for ids in col_ids.values() for cid in ids]
+    for pos in range(0, records, chunk):
+        db.insert_records([{
+            "collection_id": rnd.choice(all_cols),
+            "data": {"nom": f"Client {i}", "SIRET": f"{rnd.randrange(10 ** 13, 10 ** 14)}", "Adresse": f"{i % 200} rue de la Paix",
+                     "Ville": rnd.choice(VILLES), "Notes": "x" * rnd.randrange(50, 500), "Photos": []},
+            "created_by": "admin-1",
+        } for i in range(pos, min(pos + chunk, records))])
+    profile = db.get_profile("admin-1")
+    db.con.close()
+    return profile
+
+
+def one_run(at):
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return metrics.last()
+
+
+def report(view, cold, warm):
+    warm_ms = [r.ms for r in warm]
+    print(f"\n--- {view} ---")
+    print(f"rerun à froid   {cold.ms:8.1f} ms   {len(cold.calls):3d} appels   backend {cold.backend_ms:7.1f} ms")
+    print(f"rerun à chaud   {statistics.median(warm_ms):8.1f} ms   {len(warm[-1].calls):3d} appels   "
+          f"backend {statistics.median(r.backend_ms for r in warm):7.1f} ms   (médiane de {len(warm)})")
+    print(f"{'section':<16}{'froid ms':>10}{'appels':>8}{'chaud ms':>10}{'appels':>8}")
+    hot = warm[-1].sections()
+    for name, s in cold.sections().items():
+        h = hot.get(name, {"ms": 0.0, "calls": 0})
+        print(f"{name:<16}{s['ms']:10.1f}{s['calls']:8d}{h['ms']:10.1f}{h['calls']:8d}")
+    per_table = Counter(f"{c.op} {c.target}" for c in cold.calls)
+    print("appels à froid par table : " + ", ".join(f"{k} ×{n}" for k, n in per_table.most_common()))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--records", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--runs", type=int, default=10, help="reruns à chaud par vue")
+    args = ap.parse_args()
+    # File de tâches jetable et sans worker : seuls les reruns sont mesurés
+    jobs_dir = tempfile.mkdtemp(prefix="crm_bench_jobs_")
+    os.environ.update(CRM_JOBS_DB=os.path.join(jobs_dir, "jobs.db"), CRM_JOBS_DIR=jobs_dir, CRM_JOBS_THREADS="0")
+
+    for n in args.records:
+        tmp = tempfile.mkdtemp(prefix="crm_bench_reruns_")
+        try:
+            path = os.path.join(tmp, "crm.db")
+            t0 = time.perf_counter()
+            profile = seed(path, os.path.join(tmp, "storage"), n)
+            print(f"\nBase de {n} dossiers générée en {time.perf_counter() - t0:.1f} s")
+            os.environ.update(CRM_BACKEND="sqlite", CRM_SQLITE_PATH=path, CRM_STORAGE_DIR=os.path.join(tmp, "storage"))
+            st.cache_resource.clear()  # nouveau backend pour la nouvelle base
+
+            print(f"=== {n} dossiers ===")
+            for view in VIEWS:
+                at = AppTest.from_file(APP, default_timeout=120)
+                at.session_state["user"], at.session_state["user_db"] = SQLiteBackend(path, os.path.join(tmp, "storage")).sign_in(profile["email"], "")
+                at.session_state["profile"] = profile
+                at.session_state["view"] = view
+                cold = one_run(at)
+                warm = [one_run(at) for _ in range(args.runs)]
+                report(view, cold, warm)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(jobs_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Briques métier de Mon CRM Pro, importables hors de Streamlit (workers, benchmarks)."""
@@ -0,0 +1,571 @@
+"""Couche d'accès aux données : entreprises, activités, modèles, dossiers, profils, fichiers.
+
+Deux implémentations de la même interface :
+- `SupabaseBackend` : production (PostgREST + Auth + Storage) ;
+- `SQLiteBackend` : base SQLite + dossier local, pour le développement hors ligne,
+  les tests de charge et les benchmarks (`benchmarks/bench_reruns.py`).
+
+Le backend est choisi par `CRM_BACKEND` (`supabase` par défaut, ou `sqlite`), lu dans
+l'environnement ; voir `backend_from_env`.
+
+La connexion (`sign_in`, `refresh_session`) renvoie un backend propre à l'utilisateur, porteur de
+sa session : le backend partagé (workers, page de connexion) ne change jamais d'identité.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+from crm import images, metrics
+from crm.search import _like_prefix
+
+BUCKET = "fichiers"
+EPOCH = "1970-01-01T00:00:00+00:00"
+
+
+def tsquery(words):
+    """Mots -> tsquery Postgres en préfixe ('dupont:* & lyon:*')."""
+    return " & ".join(f"{w}:*" for w in words)
+
+
+def edit_files(data, field, add=(), remove=(), thumbs=None):
+    """Ajoute / retire des URLs du champ fichier `field` (sans doublon) et tient à jour les miniatures."""
+    urls = [u for u in dict.fromkeys(list(data.get(field) or []) + list(add)) if u not in remove]
+    out = {**data, field: urls}
+    if thumbs or images.THUMBS_KEY in data:
+        known = {k: v for k, v in (data.get(images.THUMBS_KEY) or {}).items() if k not in remove}
+        out[images.THUMBS_KEY] = {**known, **(thumbs or {})}
+    return out
+
+
+# ==========================================
+# SUPABASE
+# ==========================================
+class SupabaseBackend:
+    name = "supabase"
+    file_root = None  # fichiers servis en HTTP par Storage
+    REFRESH_MARGIN = 60  # secondes avant expiration du jeton d'accès où `keep_alive` le renouvelle
+
+    def __init__(self, client, bucket=BUCKET, new_client=None):
+        self.client = client
+        self.bucket = bucket
+        self._new_client = new_client  # client Supabase neuf, sans session : un par utilisateur connecté
+        self._session = None
+
+    # --- AUTH ---
+    def _open(self, op, call):
+        """Appel auth sur un client neuf ; renvoie (utilisateur, backend de l'utilisateur).
+
+        Le client neuf reçoit la session (ses requêtes PostgREST et Storage portent le jeton de
+        l'utilisateur : auth.uid() est le sien) ; `self.client` reste tel quel.
+        """
+        client = self._new_client()
+        with metrics.timed("auth", op):
+            res = call(client.auth)
+        backend = SupabaseBackend(metrics.InstrumentedClient(client), self.bucket, self._new_client)
+        backend._session = res.session
+        return res.user, backend
+
+    def sign_in(self, email, password):
+        """(utilisateur, backend de l'utilisateur) ; son `refresh_token` permet de restaurer la session (cookie)."""
+        return self._open("sign_in", lambda auth: auth.sign_in_with_password({"email": email, "password": password}))
+
+    def refresh_session(self, refresh_token):
+        """Session reprise depuis un refresh token (à usage unique) : (utilisateur, backend de l'utilisateur)."""
+        return self._open("refresh_session", lambda auth: auth.refresh_session(refresh_token))
+
+    @property
+    def refresh_token(self):
+        return self._session.refresh_token if self._session else None
+
+    def keep_alive(self, latest=None):
+        """Renouvelle la session si le jeton d'accès expire bientôt ; True si le refresh token a changé.
+
+        `latest` : refresh token le plus récent connu (cookie), quand un autre onglet a déjà renouvelé
+        la session et consommé le nôtre (usage unique).
+        """
+        if not self._session or self._session.expires_at - time.time() > self.REFRESH_MARGIN: return False
+        with metrics.timed("auth", "refresh_session"):
+            session = self.client.auth.refresh_session(latest or self._session.refresh_token).session
+        if session.user.id != self._session.user.id: raise ValueError("Session d'un autre utilisateur")
+        self._session = session
+        return True
+
+    def sign_up(self, email, password):
+        """Crée le compte sur un client neuf : sans confirmation d'e-mail, Supabase y ouvre la session du
+        nouvel utilisateur, qui ne doit pas remplacer celle de l'administrateur qui le crée."""
+        with metrics.timed("auth", "sign_up"):
+            return self._new_client().auth.sign_up({"email": email, "password": password}).user
+
+    def sign_out(self):
+        """Révoque la session de ce backend seulement (scope local : les autres appareils restent connectés)."""
+        if not self._session: return
+        with metrics.timed("auth", "sign_out"):
+            self.client.auth.sign_out({"scope": "local"})
+        self._session = None
+
+    # --- ENTREPRISES & PROFILS ---
+    def list_companies(self):
+        return self.client.table("companies").select("*").execute().data
+
+    def get_profile(self, user_id):
+        res = self.client.table("profiles").select("*").eq("id", user_id).execute().data
+        return res[0] if res else None
+
+    def list_profiles(self, company_id):
+        return self.client.table("profiles").select("*").eq("company_id", company_id).execute().data
+
+    def add_profile(self, profile):
+        self.client.table("profiles").insert(profile).execute()
+
+    def delete_profile(self, user_id):
+        self.client.table("profiles").delete().eq("id", user_id).execute()
+
+    # --- ACTIVITÉS & MODÈLES ---
+    def list_activities(self, company_id):
+        return self.client.table("activities").select("*").eq("company_id", company_id).execute().data
+
+    def add_activity(self, company_id, name):
+        self.client.table("activities").insert({"name": name, "company_id": company_id}).execute()
+
+    def list_collections(self, activity_ids):
+        if not activity_ids: return []
+        return self.client.table("collections").select("*").in_("activity_id", list(activity_ids)).execute().data
+
+    def add_collection(self, activity_id, name, fields):
+        self.client.table("collections").insert({"name": name, "activity_id": activity_id, "fields": fields}).execute()
+
+    def update_collection(self, collection_id, fields):
+        self.client.table("collections").update({"fields": fields}).eq("id", collection_id).execute()
+
+    def delete_collection(self, collection_id):
+        self.client.table("collections").delete().eq("id", collection_id).execute()
+
+    # --- DOSSIERS ---
+    LIST_COLUMNS = "id, collection_id, created_at, updated_at, nom:data->>nom"
+
+    def records_page(self, collection_ids, cursor=None, limit=25):
+        """Lignes de liste triées par (created_at, id) décroissants, strictement après `cursor`."""
+        q = self.client.table("records").select(self.LIST_COLUMNS).in_("collection_id", list(collection_ids))
+        if cursor:
+            ts, rid = cursor
+            q = q.or_(f'created_at.lt."{ts}",and(created_at.eq."{ts}",id.lt.{rid})')
+        return q.order("created_at", desc=True).order("id", desc=True).limit(limit).execute().data
+
+    def latest_change(self, collection_ids):
+        res = (self.client.table("records").select("updated_at").in_("collection_id", list(collection_ids))
+               .order("updated_at", desc=True).limit(1).execute().data)
+        return res[0]["updated_at"] if res else EPOCH
+
+    def records_changes(self, collection_ids, since, limit):
+        return self.client.rpc("records_changes", {"p_collection_ids": list(collection_ids), "p_since": since, "p_limit": limit}).execute().data
+
+    def get_record(self, record_id):
+        res = self.client.table("records").select("id, collection_id, data").eq("id", record_id).execute().data
+        return res[0] if res else None
+
+    def insert_records(self, rows):
+        self.client.table("records").insert(rows).execute()
+
+    def insert_record(self, collection_id, data, created_by=None):
+        """Insère un dossier et renvoie son id."""
+        row = {"collection_id": collection_id, "data": data, "created_by": created_by}
+        return self.client.table("records").insert(row).execute().data[0]["id"]
+
+    def update_record(self, record_id, data):
+        self.client.table("records").update({"data": data}).eq("id", record_id).execute()
+
+    # Écritures partielles atomiques (verrou de ligne côté Postgres) : deux écritures concurrentes
+    # sur un même dossier (tâches d'envoi, formulaire) ne s'écrasent plus.
+    def patch_record(self, record_id, patch):
+        """Remplace les clés `patch` de `data` ; False si le dossier n'existe plus."""
+        return bool(self.client.rpc("records_patch", {"p_id": record_id, "p_patch": patch}).execute().data)
+
+    def edit_files(self, record_id, field, add=(), remove=(), thumbs=None):
+        """Voir `edit_files` ; False si le dossier n'existe plus."""
+        return bool(self.client.rpc("records_edit_files", {
+            "p_id": record_id, "p_field": field, "p_add": list(add), "p_remove": list(remove), "p_thumbs": thumbs or {},
+        }).execute().data)
+
+    def delete_record(self, record_id):
+        self.client.table("records").delete().eq("id", record_id).execute()
+
+    def iter_records(self, collection_ids, chunk_size=1000):
+        """Pages successives de records complets (id croissant)."""
+        last = 0
+        while True:
+            rows = (self.client.table("records").select("id, collection_id, created_at, data")
+                    .in_("collection_id", list(collection_ids)).gt("id", last)
+                    .order("id").limit(chunk_size).execute().data)
+            if not rows: return
+            yield rows
+            if len(rows) < chunk_size: return
+            last = rows[-1]["id"]
+
+    def count_records(self, collection_ids):
+        res = self.client.table("records").select("id", count="exact").in_("collection_id", list(collection_ids)).limit(1).execute()
+        return res.count or 0
+
+    def search_records(self, collection_ids, words, fields, date_from=None, date_to=None, limit=25, offset=0):
+        return self.client.rpc("search_records", {
+            "p_collection_ids": list(collection_ids), "p_query": tsquery(words), "p_fields": fields,
+            "p_from": date_from, "p_to": date_to, "p_limit": limit, "p_offset": offset,
+        }).execute().data or []
+
+    # --- FICHIERS ---
+    def file_exists(self, path):
+        folder, name = path.rsplit("/", 1)
+        with metrics.timed("storage", "exists", path) as c:
+            c.rows = int(any(o.get("name") == name for o in self.client.storage.from_(self.bucket).list(folder, {"search": name, "limit": 1})))
+        return bool(c.rows)
+
+    def upload_file(self, path, content, content_type):
+        with metrics.timed("storage", "upload", path, rows=1, bytes=len(content)):
+            self.client.storage.from_(self.bucket).upload(path, content, {"content-type": content_type, "upsert": "true"})
+
+    def public_url(self, path):
+        with metrics.timed("storage", "public_url", path):
+            return self.client.storage.from_(self.bucket).get_public_url(path)
+
+    # --- TABLEAU DE BORD (super_admin, cumuls tenus par triggers) ---
+    def tenant_overview(self):
+        """Une ligne par entreprise : volumes, activité récente, utilisateurs, stockage."""
+        return self.client.rpc("tenant_overview", {}).execute().data or []
+
+    def tenant_collections(self, company_id):
+        return self.client.rpc("tenant_collections", {"p_company_id": company_id}).execute().data or []
+
+    def tenant_daily(self, company_id, days=90):
+        return self.client.rpc("tenant_daily", {"p_company_id": company_id, "p_days": days}).execute().data or []
+
+
+# ==========================================
+# SQLITE (local)
+# ==========================================
+NOW = "strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')"
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS companies (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS profiles (id TEXT PRIMARY KEY, email TEXT, company_id INTEGER REFERENCES companies(id), role TEXT, full_name TEXT);
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, company_id INTEGER REFERENCES companies(id),
+    created_at TEXT NOT NULL DEFAULT ({NOW}));
+CREATE TABLE IF NOT EXISTS collections (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL, fields TEXT NOT NULL,
+    activity_id INTEGER REFERENCES activities(id) ON DELETE CASCADE, created_at TEXT NOT NULL DEFAULT ({NOW}));
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY, collection_id INTEGER REFERENCES collections(id) ON DELETE CASCADE,
+    data TEXT NOT NULL, created_by TEXT,
+    created_at TEXT NOT NULL DEFAULT ({NOW}), updated_at TEXT NOT NULL DEFAULT ({NOW}));
+CREATE INDEX IF NOT EXISTS records_collection_created_idx ON records (collection_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS records_updated_idx ON records (updated_at);
+CREATE TABLE IF NOT EXISTS record_deletions (id INTEGER PRIMARY KEY, collection_id INTEGER, deleted_at TEXT NOT NULL DEFAULT ({NOW}));
+CREATE INDEX IF NOT EXISTS record_deletions_at_idx ON record_deletions (deleted_at);
+CREATE TRIGGER IF NOT EXISTS records_touch AFTER UPDATE OF data ON records
+    BEGIN UPDATE records SET updated_at = {NOW} WHERE id = NEW.id; END;
+CREATE TRIGGER IF NOT EXISTS records_log_delete AFTER DELETE ON records
+    BEGIN INSERT OR REPLACE INTO record_deletions (id, collection_id) VALUES (OLD.id, OLD.collection_id); END;
+CREATE TABLE IF NOT EXISTS auth_sessions (token TEXT PRIMARY KEY, user_id TEXT NOT NULL, created_at TEXT NOT NULL DEFAULT ({NOW}));
+CREATE TABLE IF NOT EXISTS record_counts (collection_id INTEGER PRIMARY KEY, n INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS record_daily (collection_id INTEGER, day TEXT, n INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (collection_id, day));
+CREATE TRIGGER IF NOT EXISTS records_rollup_insert AFTER INSERT ON records BEGIN
+    INSERT INTO record_counts (collection_id, n) VALUES (NEW.collection_id, 1)
+        ON CONFLICT (collection_id) DO UPDATE SET n = n + 1;
+    INSERT INTO record_daily (collection_id, day, n) VALUES (NEW.collection_id, substr(NEW.created_at, 1, 10), 1)
+        ON CONFLICT (collection_id, day) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS records_rollup_delete AFTER DELETE ON records
+    BEGIN UPDATE record_counts SET n = n - 1 WHERE collection_id = OLD.collection_id; END;
+-- Initialisation des cumuls sur une base créée avant eux
+INSERT INTO record_counts SELECT collection_id, count(*) FROM records
+    WHERE NOT EXISTS (SELECT 1 FROM record_counts) GROUP BY collection_id;
+INSERT INTO record_daily SELECT collection_id, substr(created_at, 1, 10), count(*) FROM records
+    WHERE NOT EXISTS (SELECT 1 FROM record_daily) GROUP BY 1, 2;
+"""
+
+
+def _in(values):
+    return ",".join("?" * len(values))
+
+
+class SQLiteBackend:
+    """Même interface que `SupabaseBackend`, sur un fichier SQLite et un dossier de fichiers.
+
+    L'authentification est factice (pas de mot de passe) : réservé au développement local
+    et aux mesures de performance.
+    """
+    name = "sqlite"
+    refresh_token = None  # session du backend renvoyé par `sign_in` / `refresh_session`
+
+    def __init__(self, path="crm_local.db", storage_dir="crm_storage"):
+        self.path = path
+        self.storage_dir = Path(storage_dir)
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        # LIKE ne replie la casse que sur l'ASCII : la recherche compare casefold() des deux côtés (« Élodie »)
+        self.con.create_function("casefold", 1, lambda v: v.casefold() if isinstance(v, str) else v, deterministic=True)
+        self.con.executescript("PRAGMA journal_mode=WAL; PRAGMA foreign_keys=ON;" + SQLITE_SCHEMA)
+
+    def _rows(self, table, sql, params=(), op="select"):
+        with metrics.timed(op, table, sql.split(" WHERE ", 1)[1][:80] if " WHERE " in sql else "") as c, self.lock:
+            cur = self.con.execute(sql, params)
+            rows = [dict(r) for r in cur.fetchall()]
+            if op != "select": self.con.commit()
+            c.rows = len(rows) if op == "select" else max(cur.rowcount, 0)
+        return rows
+
+    def _write(self, table, op, sql, params=()):
+        return self._rows(table, sql, params, op=op)
+
+    @staticmethod
+    def _decode(rows, *cols):
+        for r in rows:
+            for c in cols:
+                if r.get(c) is not None: r[c] = json.loads(r[c])
+        return rows
+
+    # --- AUTH ---
+    def _new_session(self, user):
+        backend = copy.copy(self)  # même connexion, sa propre session
+        backend.refresh_token = uuid.uuid4().hex
+        self._write("auth_sessions", "insert", "INSERT INTO auth_sessions (token, user_id) VALUES (?, ?)", (backend.refresh_token, user["id"]))
+        return SimpleNamespace(**user), backend
+
+    def sign_in(self, email, password):
+        res = self._rows("profiles", "SELECT id, email FROM profiles WHERE email = ?", (email,))
+        if not res: raise ValueError("Utilisateur inconnu")
+        return self._new_session(res[0])
+
+    def refresh_session(self, refresh_token):
+        res = self._rows("auth_sessions", "SELECT p.id, p.email FROM auth_sessions s JOIN profiles p ON p.id = s.user_id WHERE s.token = ?", (refresh_token,))
+        if not res: raise ValueError("Session expirée")
+        self._write("auth_sessions", "delete", "DELETE FROM auth_sessions WHERE token = ?", (refresh_token,))
+        return self._new_session(res[0])
+
+    def sign_up(self, email, password):
+        return SimpleNamespace(id=str(uuid.uuid4()), email=email)
+
+    def keep_alive(self, latest=None):
+        return False
+
+    def sign_out(self):
+        if self.refresh_token: self._write("auth_sessions", "delete", "DELETE FROM auth_sessions WHERE token = ?", (self.refresh_token,))
+        self.refresh_token = None
+
+    # --- ENTREPRISES & PROFILS ---
+    def list_companies(self):
+        return self._rows("companies", "SELECT * FROM companies")
+
+    def get_profile(self, user_id):
+        res = self._rows("profiles", "SELECT * FROM profiles WHERE id = ?", (user_id,))
+        return res[0] if res else None
+
+    def list_profiles(self, company_id):
+        return self._rows("profiles", "SELECT * FROM profiles WHERE company_id = ?", (company_id,))
+
+    def add_profile(self, profile):
+        cols = list(profile)
+        self._write("profiles", "insert", f"INSERT INTO profiles ({','.join(cols)}) VALUES ({_in(cols)})", [profile[c] for c in cols])
+
+    def delete_profile(self, user_id):
+        self._write("profiles", "delete", "DELETE FROM profiles WHERE id = ?", (user_id,))
+
+    # --- ACTIVITÉS & MODÈLES ---
+    def list_activities(self, company_id):
+        return self._rows("activities", "SELECT * FROM activities WHERE company_id = ?", (company_id,))
+
+    def add_activity(self, company_id, name):
+        self._write("activities", "insert", "INSERT INTO activities (name, company_id) VALUES (?, ?)", (name, company_id))
+
+    def list_collections(self, activity_ids):
+        ids = list(activity_ids)
+        if not ids: return []
+        return self._decode(self._rows("collections", f"SELECT * FROM collections WHERE activity_id IN ({_in(ids)})", ids), "fields")
+
+    def add_collection(self, activity_id, name, fields):
+        self._write("collections", "insert", "INSERT INTO collections (name, activity_id, fields) VALUES (?, ?, ?)", (name, activity_id, json.dumps(fields, ensure_ascii=False)))
+
+    def update_collection(self, collection_id, fields):
+        self._write("collections", "update", "UPDATE collections SET fields = ? WHERE id = ?", (json.dumps(fields, ensure_ascii=False), collection_id))
+
+    def delete_collection(self, collection_id):
+        self._write("collections", "delete", "DELETE FROM collections WHERE id = ?", (collection_id,))
+
+    # --- DOSSIERS ---
+    LIST_COLUMNS = "id, collection_id, created_at, updated_at, json_extract(data, '$.nom') AS nom"
+
+    def records_page(self, collection_ids, cursor=None, limit=25):
+        ids = list(collection_ids)
+        sql, params = f"SELECT {self.LIST_COLUMNS} FROM records WHERE collection_id IN ({_in(ids)})", ids
+        if cursor:
+            sql += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params = ids + [cursor[0], cursor[0], cursor[1]]
+        return self._rows("records", sql + " ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit])
+
+    def latest_change(self, collection_ids):
+        ids = list(collection_ids)
+        res = self._rows("records", f"SELECT max(updated_at) AS m FROM records WHERE collection_id IN ({_in(ids)})", ids)
+        return (res[0]["m"] if res else None) or EPOCH
+
+    def records_changes(self, collection_ids, since, limit):
+        ids = list(collection_ids)
+        rows = self._rows("records", (
+            f"SELECT * FROM (SELECT id, collection_id, created_at, updated_at, json_extract(data, '$.nom') AS nom, 0 AS deleted, updated_at AS changed_at "
+            f"FROM records WHERE collection_id IN ({_in(ids)}) AND updated_at > ? ORDER BY updated_at LIMIT ?) "
+            f"UNION ALL SELECT * FROM (SELECT id, collection_id, NULL, NULL, NULL, 1, deleted_at "
+            f"FROM record_deletions WHERE collection_id IN ({_in(ids)}) AND deleted_at > ? ORDER BY deleted_at LIMIT ?) "
+            "ORDER BY changed_at"), ids + [since, limit] + ids + [since, limit], op="rpc")
+        for r in rows: r["deleted"] = bool(r["deleted"])
+        return rows
+
+    def get_record(self, record_id):
+        res = self._decode(self._rows("records", "SELECT id, collection_id, data FROM records WHERE id = ?", (record_id,)), "data")
+        return res[0] if res else None
+
+    def insert_records(self, rows):
+        with metrics.timed("insert", "records", rows=len(rows)), self.lock:
+            self.con.executemany("INSERT INTO records (collection_id, data, created_by) VALUES (?, ?, ?)",
+                                 [(r["collection_id"], json.dumps(r["data"], ensure_ascii=False), r.get("created_by")) for r in rows])
+            self.con.commit()
+
+    def insert_record(self, collection_id, data, created_by=None):
+        with metrics.timed("insert", "records", rows=1), self.lock:
+            cur = self.con.execute("INSERT INTO records (collection_id, data, created_by) VALUES (?, ?, ?)",
+                                   (collection_id, json.dumps(data, ensure_ascii=False), created_by))
+            self.con.commit()
+        return cur.lastrowid
+
+    def update_record(self, record_id, data):
+        self._write("records", "update", "UPDATE records SET data = ? WHERE id = ?", (json.dumps(data, ensure_ascii=False), record_id))
+
+    def _modify(self, record_id, fn):
+        """Lecture-modification-écriture de `data` sous verrou d'écriture (BEGIN IMMEDIATE, sûr entre processus)."""
+        with metrics.timed("update", "records", "id = ?") as c, self.lock:
+            self.con.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.con.execute("SELECT data FROM records WHERE id = ?", (record_id,)).fetchone()
+                if row:
+                    self.con.execute("UPDATE records SET data = ? WHERE id = ?",
+                                     (json.dumps(fn(json.loads(row["data"])), ensure_ascii=False), record_id))
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+            c.rows = int(bool(row))
+        return bool(row)
+
+    def patch_record(self, record_id, patch):
+        return self._modify(record_id, lambda data: {**data, **patch})
+
+    def edit_files(self, record_id, field, add=(), remove=(), thumbs=None):
+        return self._modify(record_id, lambda data: edit_files(data, field, add, remove, thumbs))
+
+    def delete_record(self, record_id):
+        self._write("records", "delete", "DELETE FROM records WHERE id = ?", (record_id,))
+
+    def iter_records(self, collection_ids, chunk_size=1000):
+        ids, last = list(collection_ids), 0
+        while True:
+            rows = self._decode(self._rows("records", (
+                f"SELECT id, collection_id, created_at, data FROM records WHERE collection_id IN ({_in(ids)}) "
+                "AND id > ? ORDER BY id LIMIT ?"), ids + [last, chunk_size]), "data")
+            if not rows: return
+            yield rows
+            if len(rows) < chunk_size: return
+            last = rows[-1]["id"]
+
+    def count_records(self, collection_ids):
+        ids = list(collection_ids)
+        return self._rows("records", f"SELECT count(*) AS n FROM records WHERE collection_id IN ({_in(ids)})", ids)[0]["n"]
+
+    def search_records(self, collection_ids, words, fields, date_from=None, date_to=None, limit=25, offset=0):
+        """Équivalent approché de la RPC : chaque mot doit débuter une valeur ou un mot d'une valeur
+        (sans tenir compte de la casse, accents compris, comme le tsvector 'simple')."""
+        ids = list(collection_ids)
+        sql = f"SELECT {self.LIST_COLUMNS}, 0.0 AS rank FROM records WHERE collection_id IN ({_in(ids)})"
+        params = ids
+        for w in words:
+            w = _like_prefix(w.casefold())
+            sql += " AND (casefold(data) LIKE ? ESCAPE '\\' OR casefold(data) LIKE ? ESCAPE '\\')"
+            params += [f'%"{w}%', f"% {w}%"]
+        for name, prefix in fields.items():
+            sql += " AND casefold(COALESCE(json_extract(data, ?), '')) LIKE ? ESCAPE '\\'"
+            params += [f'$."{name}"', f"{prefix.casefold()}%"]
+        if date_from: sql, params = sql + " AND created_at >= ?", params + [date_from]
+        if date_to: sql, params = sql + " AND created_at < ?", params + [date_to]
+        return self._rows("records", sql + " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?", params + [limit, offset], op="rpc")
+
+    # --- FICHIERS ---
+    def file_exists(self, path):
+        with metrics.timed("storage", "exists", path) as c:
+            c.rows = int((self.storage_dir / path).exists())
+        return bool(c.rows)
+
+    def upload_file(self, path, content, content_type):
+        dest = self.storage_dir / path
+        with metrics.timed("storage", "upload", path, rows=1, bytes=len(content)):
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}")
+            tmp.write_bytes(content)
+            os.replace(tmp, dest)
+
+    def public_url(self, path):
+        with metrics.timed("storage", "public_url", path):
+            return (self.storage_dir / path).resolve().as_uri()
+
+    @property
+    def file_root(self):
+        """Dossier des URLs `file://` renvoyées par `public_url` (à passer à `crm.http.make_session`)."""
+        return str(self.storage_dir.resolve())
+
+    # --- TABLEAU DE BORD ---
+    def _storage_usage(self, company_id):
+        files = [f for f in (self.storage_dir / str(company_id)).rglob("*") if f.is_file()]
+        return len(files), sum(f.stat().st_size for f in files)
+
+    def tenant_overview(self):
+        """Équivalent de la RPC ; pas de dernière connexion en local (`active_users_30d` à None)."""
+        rows = self._rows("companies", (
+            "WITH cols AS (SELECT a.company_id, count(DISTINCT a.id) AS activities, count(c.id) AS collections, "
+            "COALESCE(sum(rc.n), 0) AS records FROM activities a LEFT JOIN collections c ON c.activity_id = a.id "
+            "LEFT JOIN record_counts rc ON rc.collection_id = c.id GROUP BY a.company_id), "
+            "recent AS (SELECT a.company_id, sum(d.n) AS n FROM record_daily d JOIN collections c ON c.id = d.collection_id "
+            "JOIN activities a ON a.id = c.activity_id WHERE d.day > date('now', '-7 days') GROUP BY a.company_id), "
+            "people AS (SELECT company_id, count(*) AS users FROM profiles GROUP BY company_id) "
+            "SELECT co.id AS company_id, co.name, COALESCE(cols.activities, 0) AS activities, COALESCE(cols.collections, 0) AS collections, "
+            "COALESCE(cols.records, 0) AS records, COALESCE(recent.n, 0) AS created_7d, COALESCE(people.users, 0) AS users, "
+            "NULL AS active_users_30d FROM companies co LEFT JOIN cols ON cols.company_id = co.id "
+            "LEFT JOIN recent ON recent.company_id = co.id LEFT JOIN people ON people.company_id = co.id ORDER BY 5 DESC"), op="rpc")
+        for r in rows:
+            r["files"], r["storage_bytes"] = self._storage_usage(r["company_id"])
+        return rows
+
+    def tenant_collections(self, company_id):
+        return self._rows("collections", (
+            "SELECT a.name AS activity, c.name AS collection, COALESCE(rc.n, 0) AS records, "
+            "(SELECT COALESCE(sum(d.n), 0) FROM record_daily d WHERE d.collection_id = c.id AND d.day > date('now', '-30 days')) AS created_30d "
+            "FROM activities a JOIN collections c ON c.activity_id = a.id LEFT JOIN record_counts rc ON rc.collection_id = c.id "
+            "WHERE a.company_id = ? ORDER BY 3 DESC"), (company_id,), op="rpc")
+
+    def tenant_daily(self, company_id, days=90):
+        return self._rows("record_daily", (
+            "SELECT d.day, sum(d.n) AS n FROM record_daily d JOIN collections c ON c.id = d.collection_id "
+            "JOIN activities a ON a.id = c.activity_id WHERE a.company_id = ? AND d.day > date('now', ?) "
+            "GROUP BY d.day ORDER BY d.day"), (company_id, f"-{int(days)} days"), op="rpc")
+
+
+def backend_from_env(supabase_factory=None):
+    """Backend désigné par `CRM_BACKEND`.
+
+    `supabase_factory()` doit renvoyer un client Supabase neuf, sans session (l'application le
+    construit depuis `st.secrets`) ; il est enveloppé par `metrics.InstrumentedClient`. Il sert
+    aussi à créer le client de chaque utilisateur connecté.
+    """
+    if os.environ.get("CRM_BACKEND", "supabase") == "sqlite":
+        return SQLiteBackend(os.environ.get("CRM_SQLITE_PATH", "crm_local.db"), os.environ.get("CRM_STORAGE_DIR", "crm_storage"))
+    return SupabaseBackend(metrics.InstrumentedClient(supabase_factory()), new_client=supabase_factory)
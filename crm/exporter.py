@@ -0,0 +1,121 @@
+"""Export en flux des dossiers d'un ou plusieurs modèles (CSV, Parquet, ZIP avec pièces jointes).
+
+Les records sont lus par pages (`db.iter_records`, keyset sur `id`) et écrits au fil de l'eau dans un
+fichier temporaire : la mémoire utilisée ne dépend pas du nombre de dossiers.
+Les colonnes suivent l'ordre des champs du modèle (`collections.fields`).
+"""
+import csv
+import importlib.util
+import os
+import posixpath
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+from crm.http import TIMEOUT, make_session
+
+# pyarrow, long à importer, n'est chargé qu'au premier export Parquet
+HAS_PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+CHUNK_SIZE = 1000
+DOWNLOAD_WORKERS = 8
+SPOOL_MAX_BYTES = 2 * 1024 * 1024
+FILE_TYPE = "Fichier/Image"
+SKIPPED_TYPES = ("Section/Titre",)
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "zip": ".zip"}
+
+
+def export_columns(collections):
+    """En-têtes : métadonnées puis champs dans l'ordre des modèles (union sans doublon)."""
+    cols = ["id", "modele", "created_at"]
+    for c in collections:
+        for f in c["fields"]:
+            if f["type"] not in SKIPPED_TYPES and f["name"] not in cols: cols.append(f["name"])
+    return cols
+
+
+def flatten(record, columns, col_names):
+    d = record["data"] or {}
+    meta = {"id": record["id"], "modele": col_names.get(record["collection_id"], ""), "created_at": record["created_at"]}
+    out = []
+    for c in columns:
+        v = meta[c] if c in meta else d.get(c, "")
+        out.append(" | ".join(map(str, v)) if isinstance(v, list) else ("" if v is None else str(v)))
+    return out
+
+
+def _attachments(record, file_fields):
+    for fname in file_fields:
+        for i, url in enumerate((record["data"] or {}).get(fname) or []):
+            base = posixpath.basename(unquote(urlparse(url).path)) or f"fichier_{i + 1}"
+            yield f"pieces/{record['id']}/{fname}/{i + 1:02d}_{base}", url
+
+
+def _download(session, url):
+    try:
+        with session.get(url, stream=True, timeout=TIMEOUT) as res:
+            if res.status_code != 200: return None
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+            for chunk in res.iter_content(256 * 1024): spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except Exception:
+        return None
+
+
+def export_records(db, collections, fmt="csv", on_progress=None, session=None):
+    """Écrit l'export dans un fichier temporaire et renvoie (chemin, nombre de dossiers, pièces manquantes).
+
+    `fmt` : "csv", "parquet" ou "zip" (CSV + pièces jointes téléchargées en parallèle).
+    `on_progress(n)` est appelé après chaque page avec le nombre de dossiers écrits.
+    """
+    if fmt == "parquet" and not HAS_PARQUET:
+        raise RuntimeError("Export Parquet indisponible : installez 'pyarrow'.")
+    columns = export_columns(collections)
+    col_names = {c["id"]: c["name"] for c in collections}
+    file_fields = list(dict.fromkeys(f["name"] for c in collections for f in c["fields"] if f["type"] == FILE_TYPE))
+    fd, out_path = tempfile.mkstemp(suffix=FORMATS[fmt], prefix="export_")
+    os.close(fd)
+    count, missing = 0, 0
+
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(c, pa.string()) for c in columns])
+        with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+            for rows in db.iter_records(col_names, CHUNK_SIZE):
+                flat = [flatten(r, columns, col_names) for r in rows]
+                writer.write_table(pa.Table.from_arrays([pa.array(col, pa.string()) for col in zip(*flat)], schema=schema))
+                count += len(rows)
+                if on_progress: on_progress(count)
+        return out_path, count, missing
+
+    csv_path = out_path if fmt == "csv" else out_path + ".csv"
+    zf = zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) if fmt == "zip" else None
+    session = session or (make_session(DOWNLOAD_WORKERS, file_root=db.file_root) if zf else None)
+    try:
+        with open(csv_path, "w", newline="", encoding="utf-8-sig") as fh, ThreadPoolExecutor(DOWNLOAD_WORKERS) as pool:
+            w = csv.writer(fh, delimiter=";")
+            w.writerow(columns)
+            for rows in db.iter_records(col_names, CHUNK_SIZE):
+                w.writerows(flatten(r, columns, col_names) for r in rows)
+                if zf:
+                    files = [a for r in rows for a in _attachments(r, file_fields)]
+                    # Fenêtre bornée : au plus 4 téléchargements en attente par worker
+                    for i in range(0, len(files), DOWNLOAD_WORKERS * 4):
+                        window = files[i:i + DOWNLOAD_WORKERS * 4]
+                        for (arc, _), spool in zip(window, pool.map(lambda a: _download(session, a[1]), window)):
+                            if spool is None:
+                                missing += 1
+                                continue
+                            with spool, zf.open(arc, "w") as dst:
+                                for chunk in iter(lambda: spool.read(256 * 1024), b""): dst.write(chunk)
+                count += len(rows)
+                if on_progress: on_progress(count)
+        if zf: zf.write(csv_path, "dossiers.csv")
+    finally:
+        if zf:
+            zf.close()
+            if os.path.exists(csv_path): os.remove(csv_path)
+    return out_path, count, missing
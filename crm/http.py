@@ -0,0 +1,54 @@
+"""Session HTTP partagée (pool de connexions, timeouts, reprises)."""
+import io
+import mimetypes
+import os
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.util.retry import Retry
+
+TIMEOUT = (5, 60)  # (connexion, lecture) en secondes
+POOL_SIZE = 8
+
+
+class FileAdapter(BaseAdapter):
+    """URLs `file://` du stockage local (backend SQLite), servies comme des réponses HTTP.
+
+    Seuls les fichiers sous `root` sont lus ; tout autre chemin répond 404.
+    """
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = os.path.realpath(root)
+
+    def send(self, request, **kwargs):
+        path = os.path.realpath(url2pathname(urlparse(request.url).path))
+        res = requests.Response()
+        res.url, res.request = request.url, request
+        if os.path.commonpath([self.root, path]) == self.root and os.path.isfile(path):
+            res.status_code, res.raw = 200, open(path, "rb")
+            res.headers["Content-Type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            res.headers["Content-Length"] = str(os.path.getsize(path))
+        else:
+            res.status_code, res.raw = 404, io.BytesIO()
+        return res
+
+    def close(self):
+        pass
+
+
+def make_session(pool_size=POOL_SIZE, retries=3, backoff=0.3, file_root=None):
+    """Session réutilisable : connexions keep-alive et reprise sur erreurs transitoires.
+
+    Avec `file_root`, les URLs `file://` sous ce dossier sont aussi servies (stockage local).
+    """
+    s = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    if file_root: s.mount("file://", FileAdapter(file_root))
+    return s
@@ -0,0 +1,78 @@
+"""Normalisation des images à l'envoi : redressement EXIF, réduction, recompression, miniature.
+
+Une photo de téléphone (4000x3000, 5 à 10 Mo) est stockée en JPEG d'au plus `MAX_SIDE` px
+de côté (≈ 0,5 à 1 Mo), sans métadonnées EXIF (GPS compris), accompagnée d'une miniature
+WebP de `THUMB_SIDE` px (quelques Ko) pour l'affichage en grille. Le traitement ne décode
+l'image qu'une fois ; une image illisible par Pillow (HEIC sans greffon, fichier corrompu)
+est stockée telle quelle, sans miniature.
+"""
+import io
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+MAX_SIDE = 2560
+JPEG_QUALITY = 82
+THUMB_SIDE = 320
+THUMB_QUALITY = 70
+IMAGE_EXT = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+# Clé réservée de `records.data` : {url de l'image: url de sa miniature}
+THUMBS_KEY = "_thumbs"
+
+
+@dataclass
+class Processed:
+    content: bytes
+    content_type: str
+    ext: str
+    thumb: Optional[bytes] = None  # WebP
+
+
+def is_image(file):
+    ctype = getattr(file, "type", None) or ""
+    return ctype.startswith("image/") or os.path.splitext(file.name)[1].lower() in IMAGE_EXT
+
+
+def thumb_path(path):
+    """Chemin de la miniature, à côté de l'original : `{sha256}_thumb.webp`."""
+    return f"{os.path.splitext(path)[0]}_thumb.webp"
+
+
+def _flatten(img):
+    """RGB pour le JPEG : la transparence (captures, logos) est posée sur fond blanc."""
+    from PIL import Image
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        bg = Image.new("RGB", img.size, "white")
+        bg.paste(img, mask=img.getchannel("A"))
+        return bg
+    return img.convert("RGB") if img.mode != "RGB" else img
+
+
+def process(data, max_side=MAX_SIDE, quality=JPEG_QUALITY, thumb_side=THUMB_SIDE):
+    """Image normalisée + miniature ; None si `data` n'est pas une image exploitable."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    try:
+        img = Image.open(io.BytesIO(data))
+        if getattr(img, "is_animated", False): return None
+        fmt, resized = img.format, max(img.size) > max_side
+        img.draft("RGB", (max_side, max_side))  # JPEG : décodage directement à l'échelle réduite
+        icc = img.info.get("icc_profile")
+        has_exif = bool(img.getexif())
+        img = _flatten(ImageOps.exif_transpose(img))
+        if resized: img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True, progressive=True, icc_profile=icc)
+        content = out.getvalue()
+        th = img.copy()
+        th.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+        tout = io.BytesIO()
+        th.save(tout, "WEBP", quality=THUMB_QUALITY, method=4)
+    except Exception:
+        return None
+    if fmt == "JPEG" and not resized and not has_exif and len(data) <= len(content):
+        content = data  # déjà compact, droit et sans métadonnées : l'original est conservé
+    return Processed(content, "image/jpeg", ".jpg", tout.getvalue())
@@ -0,0 +1,147 @@
+"""Import en masse de dossiers depuis un fichier CSV ou Excel.
+
+Les colonnes du fichier sont associées aux champs d'un modèle (`collections.fields`),
+chaque ligne est validée et convertie selon le type du champ, puis les lignes valides
+sont insérées par lots multi-lignes. Un import interrompu reprend à `next_row`.
+"""
+import codecs
+import csv
+import io
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from crm.sirene import autofill, clean_siret, siret_checksum_ok
+
+CHUNK_SIZE = 500
+# Types sans valeur saisissable : jamais proposés au mapping
+SKIPPED_TYPES = ("Fichier/Image", "Section/Titre")
+# Un CSV enregistré par Excel en français est en cp1252 ; latin-1 accepte tout octet
+CSV_ENCODINGS = ("utf-8-sig", "cp1252", "latin-1")
+
+
+@dataclass
+class ImportReport:
+    total: int
+    next_row: int = 0  # position (0-based) de la prochaine ligne à traiter
+    inserted: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)  # (ligne du fichier, message)
+    elapsed: float = 0.0
+    error: Optional[str] = None  # échec d'insertion ayant interrompu l'import
+
+    @property
+    def done(self):
+        return self.next_row >= self.total
+
+    @property
+    def rows_per_sec(self):
+        return self.next_row / self.elapsed if self.elapsed else 0.0
+
+
+def read_table(file):
+    """DataFrame (toutes colonnes en texte) depuis un CSV (séparateur détecté) ou un XLSX."""
+    import pandas as pd
+    name = getattr(file, "name", "").lower()
+    if name.endswith((".xlsx", ".xls")):
+        return pd.read_excel(file, dtype=str, keep_default_na=False)
+    head = file.read(64 * 1024)
+    file.seek(0)
+    if not isinstance(head, bytes):
+        return pd.read_csv(file, sep=_sniff(head), dtype=str, keep_default_na=False)
+    for enc in CSV_ENCODINGS:
+        try: text = codecs.getincrementaldecoder(enc)().decode(head)  # dernier caractère possiblement tronqué
+        except UnicodeDecodeError: continue
+        try: return pd.read_csv(file, sep=_sniff(text), dtype=str, keep_default_na=False, encoding=enc)
+        except UnicodeDecodeError: file.seek(0)  # octet invalide au-delà de l'échantillon
+
+
+def _sniff(text):
+    try: return csv.Sniffer().sniff(text, delimiters=",;\t|").delimiter
+    except csv.Error: return ","
+
+
+def importable_fields(fields):
+    return [f for f in fields if f["type"] not in SKIPPED_TYPES]
+
+
+def guess_mapping(columns, fields):
+    """Associe chaque champ à la colonne de même nom (casse et espaces ignorés)."""
+    norm = lambda x: re.sub(r"\s+", " ", str(x)).strip().lower()
+    by_name = {norm(c): c for c in columns}
+    return {f["name"]: by_name.get(norm(f["name"])) for f in importable_fields(fields)}
+
+
+def coerce(value, ftype):
+    """Valeur nettoyée selon le type de champ ; lève ValueError si invalide."""
+    v = str(value).strip()
+    if not v: return ""
+    if ftype == "SIRET":
+        s = clean_siret(v)
+        if not s: raise ValueError(f"SIRET invalide « {v} »")
+        if not siret_checksum_ok(s): raise ValueError(f"SIRET invalide « {v} » (clé de contrôle)")
+        return s
+    if ftype in ("Adresse", "Adresse Travaux", "Texte Court"):
+        return re.sub(r"\s+", " ", v)
+    return v
+
+
+def build_row(values, mapping, fields):
+    data = {}
+    for f in importable_fields(fields):
+        col = mapping.get(f["name"])
+        try:
+            data[f["name"]] = coerce(values.get(col, ""), f["type"]) if col else ""
+        except ValueError as e:
+            raise ValueError(f"{f['name']} : {e}") from None
+    return data
+
+
+def import_rows(db, collection_id, user_id, df, mapping, fields, start=0, chunk_size=CHUNK_SIZE,
+                resolver=None, on_progress=None, report=None):
+    """Valide et insère `df[start:]` par lots ; renvoie un `ImportReport`.
+
+    Avec `resolver` (crm.sirene.SiretResolver), les SIRET de chaque lot sont résolus en une
+    fois et complètent les champs restés vides (raison sociale, adresse, ville, CP).
+    En cas d'échec d'insertion, l'import s'arrête : `report.next_row` désigne le premier
+    lot non inséré, à passer en `start` pour reprendre.
+    """
+    report = report or ImportReport(total=len(df), next_row=start)
+    report.error = None
+    siret_fields = [f["name"] for f in importable_fields(fields) if f["type"] == "SIRET" and mapping.get(f["name"])]
+    t0 = time.perf_counter() - report.elapsed
+    records = df.to_dict("records")
+    for pos in range(start, len(records), chunk_size):
+        batch = []
+        for i, values in enumerate(records[pos:pos + chunk_size], pos):
+            try: batch.append(build_row(values, mapping, fields))
+            except ValueError as e: report.errors.append((i + 2, str(e)))  # +2 : en-tête + base 1
+        if resolver and siret_fields and batch:
+            found = resolver.lookup_many(d[siret_fields[0]] for d in batch if d[siret_fields[0]])
+            for d in batch:
+                info = found.get(d[siret_fields[0]])
+                if info:
+                    for k, v in autofill(fields, info).items():
+                        if not d.get(k): d[k] = v
+        if batch:
+            try:
+                db.insert_records([{"collection_id": collection_id, "data": d, "created_by": user_id} for d in batch])
+            except Exception as e:
+                # Erreurs de validation de ce lot : elles seront reproduites à la reprise
+                report.errors = [x for x in report.errors if x[0] < pos + 2]
+                report.error = str(e) or e.__class__.__name__
+                break
+        report.inserted += len(batch)
+        report.next_row = min(pos + chunk_size, len(records))
+        report.elapsed = time.perf_counter() - t0
+        if on_progress: on_progress(report)
+    report.elapsed = time.perf_counter() - t0
+    return report
+
+
+def errors_csv(report):
+    out = io.StringIO()
+    w = csv.writer(out, delimiter=";")
+    w.writerow(["ligne", "erreur"])
+    w.writerows(report.errors)
+    return out.getvalue().encode("utf-8-sig")
@@ -0,0 +1,452 @@
+"""File de tâches en arrière-plan : fusion PDF, envoi de pièces jointes, import, export.
+
+La file est une table SQLite (`CRM_JOBS_DB`) partagée entre l'application et les workers ;
+les fichiers déposés et les résultats sont rangés sous `CRM_JOBS_DIR`. Une tâche survit
+donc à un rafraîchissement du navigateur : l'utilisateur retrouve ses tâches à la reconnexion.
+
+Les workers tournent soit dans le processus Streamlit (`start_workers`), soit à part :
+
+    python -m crm.jobs worker [--threads 4] [--per-tenant 2]
+
+Au plus `per_tenant` tâches d'une même entreprise s'exécutent en même temps, et la tâche
+suivante est prise chez l'entreprise qui en a le moins en cours : une entreprise qui
+empile des exports ne bloque pas les autres.
+
+Une tâche en cours signale qu'elle est vivante toutes les `HEARTBEAT_EVERY` secondes depuis un
+thread dédié, quelle que soit la durée de ses étapes. Celle d'un worker disparu (redéploiement)
+est remise en file et reprend à son dernier point de reprise (`Context.checkpoint`).
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from crm import metrics
+
+log = logging.getLogger("crm.jobs")
+
+DEFAULT_DB = os.environ.get("CRM_JOBS_DB", "crm_jobs.db")
+JOBS_DIR = os.environ.get("CRM_JOBS_DIR", os.path.join(tempfile.gettempdir(), "crm_jobs"))
+THREADS = 2
+PER_TENANT = 2
+POLL_INTERVAL = 0.5
+STALE_AFTER = 300  # secondes sans signe de vie : tâche remise en file
+HEARTBEAT_EVERY = 30
+MAX_ATTEMPTS = 3
+KEEP_FOR = 24 * 3600  # tâches terminées (et leurs fichiers) conservées 24 h
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, kind TEXT NOT NULL, tenant TEXT NOT NULL, owner TEXT, label TEXT,
+    params TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0, message TEXT, result TEXT, error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, started_at REAL,
+    heartbeat REAL, finished_at REAL, checkpoint TEXT);
+CREATE INDEX IF NOT EXISTS jobs_status_tenant_idx ON jobs (status, tenant);
+CREATE INDEX IF NOT EXISTS jobs_owner_idx ON jobs (owner, created_at);
+"""
+
+
+class JobError(Exception):
+    """Échec métier d'une tâche : le message est affiché tel quel à l'utilisateur."""
+
+
+class JobQueue:
+    """Accès à la table `jobs` ; une connexion par thread, sûre entre processus."""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._con() as con:
+            con.executescript(SCHEMA)
+            if "checkpoint" not in {r["name"] for r in con.execute("PRAGMA table_info(jobs)")}:
+                con.execute("ALTER TABLE jobs ADD COLUMN checkpoint TEXT")  # file créée avant les reprises
+
+    def _con(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    @staticmethod
+    def _job(row):
+        if row is None: return None
+        job = dict(row)
+        for k in ("params", "result", "checkpoint"):
+            if job[k] is not None: job[k] = json.loads(job[k])
+        return job
+
+    # --- CÔTÉ APPLICATION ---
+    def submit(self, kind, tenant, params, owner=None, label=""):
+        job_id = uuid.uuid4().hex
+        self._con().execute(
+            "INSERT INTO jobs (id, kind, tenant, owner, label, params, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, str(tenant), owner, label, json.dumps(params, ensure_ascii=False, default=str), time.time()))
+        return job_id
+
+    def get(self, job_id):
+        return self._job(self._con().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, owner, limit=10):
+        rows = self._con().execute("SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?", (owner, limit)).fetchall()
+        return [self._job(r) for r in rows]
+
+    def position(self, job_id):
+        """Nombre de tâches en attente devant celle-ci, toutes entreprises confondues."""
+        return self._con().execute(
+            "SELECT count(*) FROM jobs WHERE status = 'queued' AND created_at < (SELECT created_at FROM jobs WHERE id = ?)",
+            (job_id,)).fetchone()[0]
+
+    def dismiss(self, job_id):
+        job = self.get(job_id)
+        if job and job["status"] not in ACTIVE:
+            self._con().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            _remove_result(job)
+
+    # --- CÔTÉ WORKER ---
+    def claim(self, per_tenant=PER_TENANT):
+        """Prend la prochaine tâche éligible (entreprise la moins chargée, puis la plus ancienne)."""
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            row = con.execute("""
+                SELECT j.* FROM jobs j
+                LEFT JOIN (SELECT tenant, count(*) AS n FROM jobs WHERE status = 'running' GROUP BY tenant) r ON r.tenant = j.tenant
+                WHERE j.status = 'queued' AND COALESCE(r.n, 0) < ?
+                ORDER BY COALESCE(r.n, 0), j.created_at LIMIT 1""", (per_tenant,)).fetchone()
+            if row:
+                now = time.time()
+                con.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, heartbeat = ? WHERE id = ?",
+                            (now, now, row["id"]))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return self.get(row["id"]) if row else None
+
+    def progress(self, job_id, progress, message=None):
+        self._con().execute("UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat = ? WHERE id = ?",
+                            (min(max(progress, 0.0), 1.0), message, time.time(), job_id))
+
+    def heartbeat(self, job_id):
+        self._con().execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def checkpoint(self, job_id, state):
+        """Paramètres à surcharger si la tâche est relancée (ex. {"start": 1500})."""
+        self._con().execute("UPDATE jobs SET checkpoint = ?, heartbeat = ? WHERE id = ?",
+                            (json.dumps(state, ensure_ascii=False, default=str), time.time(), job_id))
+
+    def finish(self, job_id, result=None, message=None):
+        self._con().execute(
+            "UPDATE jobs SET status = 'done', progress = 1, result = ?, message = COALESCE(?, message), finished_at = ? WHERE id = ?",
+            (json.dumps(result or {}, ensure_ascii=False, default=str), message, time.time(), job_id))
+
+    def fail(self, job_id, error, result=None):
+        self._con().execute("UPDATE jobs SET status = 'failed', error = ?, result = ?, finished_at = ? WHERE id = ?",
+                            (error, json.dumps(result, ensure_ascii=False, default=str) if result else None, time.time(), job_id))
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """Tâches d'un worker disparu : remises en file, ou en échec après `MAX_ATTEMPTS`."""
+        limit = time.time() - stale_after
+        con = self._con()
+        con.execute("UPDATE jobs SET status = 'failed', error = 'Worker interrompu', finished_at = ? "
+                    "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?", (time.time(), limit, MAX_ATTEMPTS))
+        con.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND heartbeat < ?", (limit,))
+
+    def purge(self, keep_for=KEEP_FOR):
+        rows = self._con().execute("SELECT * FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                   (time.time() - keep_for,)).fetchall()
+        for r in rows:
+            self._con().execute("DELETE FROM jobs WHERE id = ?", (r["id"],))
+            _remove_result(self._job(r))
+        # Dépôts orphelins (tâche en échec avant d'avoir consommé ses fichiers)
+        root = os.path.join(JOBS_DIR, "spool")
+        for d in os.listdir(root) if os.path.isdir(root) else ():
+            if os.path.getmtime(os.path.join(root, d)) < time.time() - keep_for:
+                shutil.rmtree(os.path.join(root, d), ignore_errors=True)
+        return len(rows)
+
+
+# --- FICHIERS ---
+def _remove_result(job):
+    path = (job.get("result") or {}).get("path")
+    if path and path.startswith(os.path.abspath(JOBS_DIR)) and os.path.exists(path): os.remove(path)
+
+
+def result_path(job_id, ext):
+    os.makedirs(os.path.join(JOBS_DIR, "results"), exist_ok=True)
+    return os.path.abspath(os.path.join(JOBS_DIR, "results", f"{job_id}{ext}"))
+
+
+def spool(files):
+    """Recopie des fichiers déposés (`st.file_uploader`) sous `JOBS_DIR/spool`, lisibles par les workers."""
+    folder = os.path.join(JOBS_DIR, "spool", uuid.uuid4().hex)
+    os.makedirs(folder, exist_ok=True)
+    out = []
+    for i, f in enumerate(files):
+        path = os.path.abspath(os.path.join(folder, f"{i:03d}_{os.path.basename(f.name)}"))
+        f.seek(0)
+        with open(path, "wb") as dst: shutil.copyfileobj(f, dst, 1024 * 1024)
+        f.seek(0)
+        out.append({"path": path, "name": f.name, "type": getattr(f, "type", None)})
+    return out
+
+
+def _unspool(files):
+    for f in files:
+        if os.path.exists(f["path"]): os.remove(f["path"])
+    folders = {os.path.dirname(f["path"]) for f in files}
+    for d in folders: shutil.rmtree(d, ignore_errors=True)
+
+
+class SpooledUpload(io.BufferedReader):
+    """Fichier du spool ouvert en lecture (tell, seekable... : lisible par pandas et zipfile),
+    avec le nom, le type et la taille de l'`UploadedFile` d'origine, et son `getvalue`."""
+
+    def __init__(self, path, name, type=None):
+        super().__init__(io.FileIO(path, "rb"))
+        self.path, self._name, self.type = path, name, type
+        self.size = os.path.getsize(path)
+
+    @property
+    def name(self):
+        return self._name
+
+    def getvalue(self):
+        self.seek(0)
+        return self.read()
+
+
+# --- TRAITEMENTS ---
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+class Context:
+    """Ce dont un traitement dispose : backend, moteur PDF partagé, remontée de progression."""
+
+    def __init__(self, queue, job, db, engine_factory):
+        self.queue, self.job, self.db = queue, job, db
+        self._engine_factory = engine_factory
+
+    @property
+    def engine(self):
+        return self._engine_factory()
+
+    def progress(self, done, total, message=None):
+        self.queue.progress(self.job["id"], done / total if total else 1.0, message)
+
+    def checkpoint(self, **state):
+        """Travail déjà fait et persisté : une relance de la tâche reçoit `state` en paramètres."""
+        self.queue.checkpoint(self.job["id"], state)
+
+
+@handler("pdf_merge")
+def run_pdf_merge(ctx, urls, record_id):
+    ctx.progress(0, 1, f"Fusion de {len(urls)} pièce(s)")
+    path = result_path(ctx.job["id"], ".pdf")
+    merged, missing = ctx.engine.merge_to_file(urls)
+    size = os.path.getsize(merged)
+    if ctx.engine.is_cached(merged): shutil.copyfile(merged, path)  # le cache du moteur peut évincer l'original
+    else: shutil.move(merged, path)  # PDF partiel, ou moteur sans cache : fichier temporaire
+    summary = f"{len(urls) - len(missing)} pièce(s) fusionnée(s)"
+    if missing:
+        names = ", ".join(os.path.basename(urlparse(u).path) for u in missing)
+        summary += f" — ⚠️ {len(missing)} pièce(s) manquante(s) : {names}"
+    return {"path": path, "filename": f"Dossier_{record_id}.pdf", "mime": "application/pdf", "summary": summary,
+            "missing": missing, "rows": len(urls) - len(missing), "bytes": size}
+
+
+@handler("upload")
+def run_upload(ctx, files, company_id, collection_id, record_id, field):
+    """Envoie les fichiers puis ajoute leurs URLs au champ `field` du dossier (et les miniatures des images).
+
+    L'ajout est atomique (`db.edit_files`) : les tâches visant d'autres champs du même dossier, ou une
+    sauvegarde du formulaire, ne sont pas écrasées. Relancée, la tâche ne renvoie rien (contenu déjà
+    stocké) et n'ajoute aucun doublon.
+    """
+    from crm import uploads
+    opened = [SpooledUpload(**f) for f in files]
+    try:
+        results = uploads.upload_files(ctx.db, opened, company_id, collection_id,
+                                       on_progress=lambda d, t, r: ctx.progress(d, t, f"{d}/{t} — {r.name}"))
+    finally:
+        for f in opened: f.close()
+    ok = [r for r in results if r.ok]
+    if not ctx.db.edit_files(record_id, field, add=[r.url for r in ok], thumbs={r.url: r.thumb_url for r in ok if r.thumb_url}):
+        raise JobError("Dossier supprimé pendant l'envoi.")
+    failed = [f"{r.name} : {r.error}" for r in results if not r.ok]
+    _unspool(files)
+    if failed: raise JobError(f"{len(failed)} fichier(s) en échec — " + " ; ".join(failed))
+    size, stored = sum(r.size for r in results), sum(r.stored for r in results)
+    return {"record_id": record_id, "rows": len(results), "bytes": stored,
+            "summary": f"{len(results)} fichier(s) ajouté(s) au dossier #{record_id} ({size / 1e6:.1f} Mo reçus, {stored / 1e6:.1f} Mo stockés)"}
+
+
+@handler("import")
+def run_import(ctx, file, collection_id, user_id, mapping, fields, start=0, sirene_index=None, inserted=0, errors=()):
+    """Import par lots ; avec `sirene_index`, complète les champs vides via SIRENE.
+
+    Chaque lot inséré est noté en point de reprise : une tâche relancée reprend au lot suivant,
+    avec les compteurs et les lignes rejetées des lots déjà traités.
+    """
+    from crm import importer, sirene
+    with SpooledUpload(**file) as f: df = importer.read_table(f)
+    resolver = sirene.SiretResolver(sirene_index) if sirene_index else None
+
+    def on_progress(r):
+        ctx.checkpoint(start=r.next_row, inserted=r.inserted, errors=r.errors)
+        ctx.progress(r.next_row, r.total, f"{r.next_row}/{r.total} lignes — {r.rows_per_sec:.0f} lignes/s")
+
+    report = importer.ImportReport(total=len(df), next_row=start, inserted=inserted, errors=[tuple(e) for e in errors])
+    rep = importer.import_rows(ctx.db, collection_id, user_id, df, mapping, fields, start=start, resolver=resolver,
+                               on_progress=on_progress, report=report)
+    result = {"inserted": rep.inserted, "rejected": len(rep.errors), "next_row": rep.next_row, "total": rep.total,
+              "rows_per_sec": round(rep.rows_per_sec), "file": file, "rows": rep.inserted,
+              "summary": f"{rep.inserted} dossier(s) créé(s), {len(rep.errors)} ligne(s) rejetée(s)"}
+    if rep.errors:
+        result["path"] = result_path(ctx.job["id"], ".csv")
+        result.update(filename="erreurs_import.csv", mime="text/csv")
+        with open(result["path"], "wb") as fh: fh.write(importer.errors_csv(rep))
+    if rep.error:
+        raise JobError(f"Import interrompu à la ligne {rep.next_row + 2} : {rep.error}", result)
+    _unspool([file])
+    return result
+
+
+@handler("export")
+def run_export(ctx, collections, fmt, company_id):
+    from crm import exporter
+    total = max(ctx.db.count_records([c["id"] for c in collections]), 1)
+    tmp, count, missing = exporter.export_records(ctx.db, collections, fmt,
+                                                  on_progress=lambda n: ctx.progress(n, total, f"{n}/{total} dossiers exportés"))
+    path = result_path(ctx.job["id"], os.path.splitext(tmp)[1])
+    shutil.move(tmp, path)
+    summary = f"{count} dossier(s)" + (f", {missing} pièce(s) introuvable(s)" if missing else "")
+    return {"path": path, "filename": f"export_{company_id}{os.path.splitext(path)[1]}", "summary": summary,
+            "rows": count, "bytes": os.path.getsize(path)}
+
+
+# --- WORKERS ---
+def resume_params(job, **params):
+    """Paramètres de la relance d'une tâche en échec : `params`, surchargés par son dernier point de
+    reprise (import : le rapport et le CSV des rejets couvrent aussi les lots déjà insérés)."""
+    return {**params, **(job.get("checkpoint") or {})}
+
+
+def _heartbeat(queue, job_id, done, every):
+    while not done.wait(every):
+        try: queue.heartbeat(job_id)
+        except sqlite3.Error: log.exception("signe de vie de la tâche %s", job_id)
+
+
+def run_job(queue, job, db, engine_factory):
+    ctx = Context(queue, job, db, engine_factory)
+    done = threading.Event()
+    threading.Thread(target=_heartbeat, args=(queue, job["id"], done, HEARTBEAT_EVERY), daemon=True,
+                     name=f"crm-job-heartbeat-{job['id'][:8]}").start()
+    try:
+        with metrics.timed("job", job["kind"], f"tenant={job['tenant']}") as c:
+            result = HANDLERS[job["kind"]](ctx, **{**job["params"], **(job.get("checkpoint") or {})})
+            c.rows, c.bytes = result.get("rows", 0), result.get("bytes", 0)
+        queue.finish(job["id"], result)
+    except JobError as e:
+        queue.fail(job["id"], e.args[0], e.args[1] if len(e.args) > 1 else None)
+    except Exception as e:
+        log.exception("tâche %s (%s) en échec", job["id"], job["kind"])
+        queue.fail(job["id"], str(e) or e.__class__.__name__)
+    finally:
+        done.set()
+
+
+def _worker_loop(queue, db, engine_factory, per_tenant, stop):
+    while not stop.is_set():
+        job = queue.claim(per_tenant)
+        if job: run_job(queue, job, db, engine_factory)
+        else: stop.wait(POLL_INTERVAL)
+
+
+def _janitor(queue, stop, every=60):
+    while not stop.wait(every):
+        try:
+            queue.requeue_stale()
+            queue.purge()
+        except sqlite3.Error:
+            log.exception("maintenance de la file")
+
+
+def start_workers(queue, db, threads=THREADS, per_tenant=PER_TENANT, engine_factory=None):
+    """Démarre `threads` workers (threads démons) ; renvoie l'`Event` qui les arrête."""
+    if engine_factory is None:
+        from crm.pdf import PdfMergeEngine
+        engine = []
+        lock = threading.Lock()
+
+        def engine_factory():
+            with lock:
+                if not engine: engine.append(PdfMergeEngine(file_root=db.file_root))
+            return engine[0]
+    stop = threading.Event()
+    for i in range(threads):
+        threading.Thread(target=_worker_loop, args=(queue, db, engine_factory, per_tenant, stop),
+                         daemon=True, name=f"crm-job-{i}").start()
+    threading.Thread(target=_janitor, args=(queue, stop), daemon=True, name="crm-job-janitor").start()
+    return stop
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m crm.jobs")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("worker", help="traiter la file (backend choisi par CRM_BACKEND)")
+    w.add_argument("--db", default=DEFAULT_DB)
+    w.add_argument("--threads", type=int, default=4)
+    w.add_argument("--per-tenant", type=int, default=PER_TENANT)
+    sub.add_parser("purge", help="supprimer les tâches terminées depuis plus de 24 h").add_argument("--db", default=DEFAULT_DB)
+    args = ap.parse_args(argv)
+
+    queue = JobQueue(args.db)
+    if args.cmd == "purge":
+        print(f"{queue.purge()} tâche(s) supprimée(s)")
+        return 0
+
+    from crm.data import backend_from_env
+
+    def supabase_client():
+        # Aucune session utilisateur ici : la clé anon seule est rejetée par les politiques « authentifié »
+        if not os.environ.get("SUPABASE_SERVICE_KEY"): ap.error("SUPABASE_SERVICE_KEY (clé service_role) est requise")
+        from supabase import create_client
+        return create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    stop = start_workers(queue, backend_from_env(supabase_client), args.threads, args.per_tenant)
+    log.info("%d worker(s) sur %s, %d tâche(s) simultanée(s) par entreprise", args.threads, args.db, args.per_tenant)
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        stop.set()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
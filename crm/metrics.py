@@ -0,0 +1,278 @@
+"""Instrumentation des appels backend (Supabase, Storage, SIRET, fusion PDF).
+
+Chaque rerun Streamlit ouvre un `Rerun` (via `start_rerun`) qui collecte, pour le thread
+du script, tous les appels : opération, cible, filtres, lignes, taille de la réponse,
+latence. En parallèle, des compteurs globaux au processus alimentent :
+- un log JSON par rerun (logger `crm.metrics`, niveau INFO ; un log par appel en DEBUG) ;
+- un export texte au format Prometheus (`prometheus_text`), servi sur
+  `CRM_METRICS_PORT` si cette variable d'environnement est définie.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+log = logging.getLogger("crm.metrics")
+
+RERUN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+CALL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+WINDOW = 500  # reruns conservés pour les percentiles affichés
+WRITE_OPS = ("insert", "update", "upsert", "delete")
+
+
+@dataclass
+class Call:
+    op: str
+    target: str
+    detail: str = ""
+    rows: int = 0
+    bytes: int = 0
+    ms: float = 0.0
+    ok: bool = True
+    section: str = ""
+
+
+@dataclass
+class Rerun:
+    view: str = ""
+    started: float = field(default_factory=time.perf_counter)
+    calls: List[Call] = field(default_factory=list)
+    ms: float = 0.0
+    marks: List[Tuple[str, float]] = field(default_factory=list)  # (section, début)
+
+    @property
+    def backend_ms(self):
+        return sum(c.ms for c in self.calls)
+
+    def slowest(self, n=10):
+        return sorted(self.calls, key=lambda c: c.ms, reverse=True)[:n]
+
+    def sections(self):
+        """{section: {ms, calls, backend_ms}} ; une section court jusqu'au `mark` suivant."""
+        end = self.started + self.ms / 1000 if self.ms else time.perf_counter()
+        out = {}
+        for (name, t0), (_, t1) in zip(self.marks, self.marks[1:] + [("", end)]):
+            s = out.setdefault(name, {"ms": 0.0, "calls": 0, "backend_ms": 0.0})
+            s["ms"] += (t1 - t0) * 1000
+        for c in self.calls:
+            if c.section in out:
+                out[c.section]["calls"] += 1
+                out[c.section]["backend_ms"] += c.ms
+        return out
+
+
+_current = contextvars.ContextVar("crm_rerun", default=None)
+_lock = threading.Lock()
+_calls_total = defaultdict(int)         # (op, target, ok) -> n
+_call_hist = defaultdict(lambda: [0] * (len(CALL_BUCKETS) + 1))  # (op, target) -> buckets
+_call_sum = defaultdict(float)          # (op, target) -> secondes
+_rows_total = defaultdict(int)          # (op, target) -> lignes / fichiers
+_bytes_total = defaultdict(int)         # (op, target) -> octets
+_rerun_hist = [0] * (len(RERUN_BUCKETS) + 1)
+_rerun_sum = 0.0
+_recent = deque(maxlen=WINDOW)          # durées des derniers reruns (s)
+_last = None                            # dernier rerun clos, tous threads confondus
+
+
+# --- COLLECTE ---
+def start_rerun(view=""):
+    run = Rerun(view=view)
+    _current.set(run)
+    return run
+
+
+def current():
+    return _current.get()
+
+
+def last():
+    """Dernier rerun clos du processus (benchmarks : le script tourne dans un autre thread)."""
+    return _last
+
+
+def mark(section):
+    """Ouvre une section du script (onglet, panneau) : les appels suivants lui sont attribués."""
+    run = _current.get()
+    if run: run.marks.append((section, time.perf_counter()))
+
+
+def end_rerun(run=None):
+    """Clôt le rerun : histogramme global, log JSON récapitulatif."""
+    global _rerun_sum, _last
+    run = run or _current.get()
+    if not run or run.ms: return run
+    run.ms = (time.perf_counter() - run.started) * 1000
+    with _lock:
+        _rerun_hist[bisect.bisect_left(RERUN_BUCKETS, run.ms / 1000)] += 1
+        _rerun_sum += run.ms / 1000
+        _recent.append(run.ms / 1000)
+        _last = run
+    log.info(json.dumps({
+        "event": "rerun", "view": run.view, "ms": round(run.ms, 1), "calls": len(run.calls),
+        "backend_ms": round(run.backend_ms, 1), "bytes": sum(c.bytes for c in run.calls),
+        "slowest": [asdict(c) for c in run.slowest(3)],
+    }, ensure_ascii=False, default=str))
+    return run
+
+
+def record(call):
+    with _lock:
+        key = (call.op, call.target)
+        _calls_total[key + (call.ok,)] += 1
+        _call_hist[key][bisect.bisect_left(CALL_BUCKETS, call.ms / 1000)] += 1
+        _call_sum[key] += call.ms / 1000
+        _rows_total[key] += call.rows
+        _bytes_total[key] += call.bytes
+    run = _current.get()
+    if run:
+        if run.marks: call.section = run.marks[-1][0]
+        run.calls.append(call)
+    elif call.op == "job":  # tâche de fond : hors de tout rerun, une ligne par tâche
+        log.info(json.dumps({"event": "job", **asdict(call)}, ensure_ascii=False, default=str))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(json.dumps({"event": "call", **asdict(call)}, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def timed(op, target, detail="", rows=0, bytes=0):
+    """Mesure un bloc ; le `Call` produit peut être complété (rows, bytes) dans le bloc."""
+    call = Call(op, target, detail, rows, bytes)
+    t0 = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.ok = False
+        raise
+    finally:
+        call.ms = (time.perf_counter() - t0) * 1000
+        record(call)
+
+
+def percentile(p):
+    with _lock:
+        data = sorted(_recent)
+    if not data: return 0.0
+    return data[min(len(data) - 1, int(round(p / 100 * (len(data) - 1))))]
+
+
+# --- CLIENT SUPABASE INSTRUMENTÉ ---
+def _short(v):
+    if isinstance(v, (list, tuple, set)): return f"[{len(v)}]"
+    s = str(v)
+    return s if len(s) <= 40 else s[:37] + "..."
+
+
+def _size(data):
+    try: return len(json.dumps(data, default=str))
+    except (TypeError, ValueError): return 0
+
+
+class _Query:
+    """Enveloppe d'un builder postgrest : note l'opération et les filtres, mesure `execute()`."""
+
+    def __init__(self, builder, op, target, filters=()):
+        self._b, self._op, self._target, self._filters = builder, op, target, list(filters)
+
+    def __getattr__(self, name):
+        attr = getattr(self._b, name)
+        if not callable(attr): return attr
+
+        def call(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            if not hasattr(res, "execute"): return res
+            op = name if name in ("select",) + WRITE_OPS else self._op
+            filters = self._filters
+            if name not in ("select",) + WRITE_OPS:
+                filters = filters + [f"{name}({', '.join(map(_short, args))})"]
+            return _Query(res, op, self._target, filters)
+        return call
+
+    def execute(self):
+        with timed(self._op, self._target, " ".join(self._filters)) as c:
+            res = self._b.execute()
+            data = getattr(res, "data", None)
+            c.rows = len(data) if isinstance(data, list) else int(bool(data))
+            c.bytes = _size(data)
+        return res
+
+
+class InstrumentedClient:
+    """Client Supabase dont chaque `table(...)...execute()` et `rpc(...).execute()` est mesuré."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _Query(self._client.table(name), "select", name)
+
+    def rpc(self, fn, params=None, **kwargs):
+        return _Query(self._client.rpc(fn, params or {}, **kwargs), "rpc", fn, [_short(k) for k in (params or {})])
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# --- EXPORT PROMETHEUS ---
+def _labels(**kw):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in kw.items()) + "}"
+
+
+def _histogram(lines, name, buckets, counts, total, **labels):
+    acc = 0
+    for b, n in zip(buckets, counts):
+        acc += n
+        lines.append(f"{name}_bucket{_labels(**labels, le=b)} {acc}")
+    acc += counts[-1]
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {acc}")
+    lines.append(f"{name}_sum{_labels(**labels) if labels else ''} {total}")
+    lines.append(f"{name}_count{_labels(**labels) if labels else ''} {acc}")
+
+
+def prometheus_text():
+    with _lock:
+        lines = ["# TYPE crm_backend_calls_total counter"]
+        for (op, target, ok), n in sorted(_calls_total.items()):
+            lines.append(f"crm_backend_calls_total{_labels(op=op, target=target, ok=str(ok).lower())} {n}")
+        lines.append("# TYPE crm_backend_call_seconds histogram")
+        for (op, target), counts in sorted(_call_hist.items()):
+            _histogram(lines, "crm_backend_call_seconds", CALL_BUCKETS, counts, _call_sum[(op, target)], op=op, target=target)
+        for name, totals in (("crm_backend_rows_total", _rows_total), ("crm_backend_bytes_total", _bytes_total)):
+            lines.append(f"# TYPE {name} counter")
+            for (op, target), n in sorted(totals.items()):
+                lines.append(f"{name}{_labels(op=op, target=target)} {n}")
+        lines.append("# TYPE crm_rerun_seconds histogram")
+        _histogram(lines, "crm_rerun_seconds", RERUN_BUCKETS, _rerun_hist, _rerun_sum)
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode()
+        self.send_response(200 if self.path.rstrip("/") in ("", "/metrics") else 404)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def setup(port=None):
+    """À appeler une fois par processus : logs JSON sur stderr et endpoint /metrics optionnel."""
+    log.setLevel(os.environ.get("CRM_METRICS_LOG", "INFO"))
+    if not log.handlers:
+        log.addHandler(logging.StreamHandler())
+        log.propagate = False
+    port = port or os.environ.get("CRM_METRICS_PORT")
+    if not port: return None
+    httpd = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="crm-metrics").start()
+    return httpd
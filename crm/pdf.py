@@ -0,0 +1,168 @@
+"""Fusion des pièces jointes d'un dossier (PDF, JPG, PNG) en un seul PDF.
+
+Les téléchargements passent par une session HTTP poolée et s'exécutent en parallèle ;
+chaque fichier est mis en tampon dans un `SpooledTemporaryFile` (bascule sur disque
+au-delà de `SPOOL_MAX_BYTES`). Les images sont réduites à `image_dpi` sur une page A4
+avant conversion. Le PDF final est mis en cache sur disque, indexé par la liste
+ordonnée des URLs : les chemins de stockage étant dérivés du contenu, une même liste
+désigne toujours les mêmes fichiers. Un PDF auquel il manque une pièce (téléchargement
+ou conversion en échec) n'est jamais mis en cache : la fusion suivante le reconstruit.
+"""
+import hashlib
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from crm.http import TIMEOUT, make_session
+
+MAX_WORKERS = 8
+SPOOL_MAX_BYTES = 2 * 1024 * 1024
+DOWNLOAD_CHUNK = 256 * 1024
+IMAGE_DPI = 150
+JPEG_QUALITY = 80
+A4_INCHES = (8.27, 11.69)
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "crm_pdf_cache")
+CACHE_MAX_FILES = 64
+
+PDF_EXT = (".pdf",)
+IMAGE_EXT = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _kind(url, content_type=""):
+    path = urlparse(url).path.lower()
+    if path.endswith(PDF_EXT) or "pdf" in content_type: return "pdf"
+    if path.endswith(IMAGE_EXT) or content_type.startswith("image/"): return "image"
+    return None
+
+
+class PdfMergeEngine:
+    """Moteur de fusion partagé entre sessions (à instancier une fois, ex. via `st.cache_resource`)."""
+
+    def __init__(self, session=None, max_workers=MAX_WORKERS, image_dpi=IMAGE_DPI,
+                 jpeg_quality=JPEG_QUALITY, cache_dir=CACHE_DIR, cache_max_files=CACHE_MAX_FILES, file_root=None):
+        self.session = session or make_session(max_workers, file_root=file_root)  # file_root : voir `db.file_root`
+        self.max_workers = max_workers
+        self.image_dpi = image_dpi  # None : images conservées en pleine résolution
+        self.jpeg_quality = jpeg_quality
+        self.cache_dir = cache_dir
+        self.cache_max_files = cache_max_files
+        if cache_dir: os.makedirs(cache_dir, exist_ok=True)
+
+    # --- CACHE ---
+    def cache_key(self, urls):
+        h = hashlib.sha256(f"dpi={self.image_dpi};q={self.jpeg_quality}".encode())
+        for u in urls: h.update(b"\n" + u.encode())
+        return h.hexdigest()
+
+    def cached_path(self, urls):
+        if not self.cache_dir: return None
+        path = os.path.join(self.cache_dir, f"{self.cache_key(urls)}.pdf")
+        return path if os.path.exists(path) else None
+
+    def is_cached(self, path):
+        """Un chemin renvoyé par `merge_to_file` est-il dans le cache ? Sinon, à supprimer par l'appelant."""
+        return bool(self.cache_dir) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.cache_dir)
+
+    def _evict(self):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".pdf")]
+        files.sort(key=os.path.getmtime, reverse=True)
+        for old in files[self.cache_max_files:]:
+            try: os.remove(old)
+            except OSError: pass
+
+    # --- TÉLÉCHARGEMENT ---
+    def download(self, url):
+        """Renvoie (type, fichier spoolé positionné au début) ou (None, None) si indisponible."""
+        try:
+            with self.session.get(url, stream=True, timeout=TIMEOUT) as res:
+                if res.status_code != 200: return None, None
+                kind = _kind(url, res.headers.get("content-type", ""))
+                if not kind: return None, None
+                spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+                for chunk in res.iter_content(DOWNLOAD_CHUNK): spool.write(chunk)
+            spool.seek(0)
+            return kind, spool
+        except requests.RequestException:
+            return None, None
+
+    # --- CONVERSION ---
+    def image_to_pdf(self, fh):
+        """Image -> PDF d'une page, réduite pour tenir sur un A4 à `image_dpi`."""
+        from PIL import Image
+        img = Image.open(fh)
+        if self.image_dpi:
+            w, h = (int(x * self.image_dpi) for x in A4_INCHES)
+            box = (h, w) if img.width > img.height else (w, h)
+            img.draft("RGB", box)  # JPEG : décodage directement à taille réduite
+            img.thumbnail(box, Image.LANCZOS)
+        if img.mode != "RGB": img = img.convert("RGB")
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        img.save(out, format="PDF", resolution=float(self.image_dpi or 72), quality=self.jpeg_quality)
+        img.close()
+        out.seek(0)
+        return out
+
+    # --- FUSION ---
+    def _downloads(self, urls):
+        """(url, type, fichier) dans l'ordre de `urls`, avec au plus `max_workers` téléchargements en avance."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            todo, pending = iter(urls), deque()
+            for url in todo:
+                pending.append((url, pool.submit(self.download, url)))
+                if len(pending) < self.max_workers: continue
+                url, fut = pending.popleft()
+                yield (url, *fut.result())
+            while pending:
+                url, fut = pending.popleft()
+                yield (url, *fut.result())
+
+    def merge_to_file(self, urls):
+        """(chemin du PDF fusionnant `urls` dans l'ordre, URLs manquantes).
+
+        Servi depuis le cache si déjà construit. S'il manque des pièces, ou sans cache, le PDF est un
+        fichier temporaire à la charge de l'appelant (voir `is_cached`).
+        """
+        from pypdf import PdfReader, PdfWriter
+        urls = list(urls)
+        hit = self.cached_path(urls)
+        if hit:
+            os.utime(hit)
+            return hit, []
+        writer = PdfWriter()
+        opened, missing = [], []
+        for url, kind, fh in self._downloads(urls):
+            if not fh:
+                missing.append(url)
+                continue
+            opened.append(fh)
+            try:
+                if kind == "image":
+                    fh = self.image_to_pdf(fh)
+                    opened.append(fh)
+                # pypdf relit les pages à l'écriture : le fichier reste ouvert, mais sur disque
+                if isinstance(fh, tempfile.SpooledTemporaryFile): fh.rollover()
+                for page in PdfReader(fh).pages: writer.add_page(page)
+            except Exception:
+                missing.append(url)
+        cache_dir = self.cache_dir or tempfile.gettempdir()
+        fd, tmp = tempfile.mkstemp(suffix=".pdf", dir=cache_dir if not missing else None)
+        with os.fdopen(fd, "wb") as out: writer.write(out)
+        for fh in opened: fh.close()
+        if missing or not self.cache_dir: return tmp, missing
+        path = os.path.join(cache_dir, f"{self.cache_key(urls)}.pdf")
+        os.replace(tmp, path)
+        self._evict()
+        return path, []
+
+    def merge(self, urls):
+        """Contenu du PDF fusionné (pièces manquantes ignorées)."""
+        path, missing = self.merge_to_file(urls)
+        try:
+            with open(path, "rb") as fh:
+                return fh.read()
+        finally:
+            if not self.is_cached(path): os.remove(path)
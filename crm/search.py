@@ -0,0 +1,53 @@
+"""Recherche de dossiers sur le contenu JSON `data` des records.
+
+Sur Supabase, la recherche s'appuie sur la colonne générée `records.search`
+(tsvector + index GIN) et la fonction RPC `search_records` (voir le README). Syntaxe de la saisie :
+
+    dupont lyon              tous les mots, en préfixe, dans n'importe quel champ
+    ville:lyon               préfixe sur un champ précis
+    "Raison sociale":acme    nom de champ contenant des espaces
+"""
+import re
+from datetime import datetime, time, timedelta
+
+FIELD_TERM = re.compile(r'(?:"([^"]+)"|([^\s:"]+)):(\S+)')
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _like_prefix(value):
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+def parse_query(text, field_names=()):
+    """Sépare la saisie en (mots en préfixe, {champ: préfixe LIKE échappé}).
+
+    Les noms de champ sont comparés sans tenir compte de la casse et ramenés au
+    nom exact du modèle ; un champ inconnu est traité comme du texte libre.
+    """
+    known = {f.lower(): f for f in field_names}
+    fields, words = {}, []
+
+    def _field(m):
+        name = known.get((m.group(1) or m.group(2)).lower())
+        if not name: return m.group(0)
+        fields[name] = _like_prefix(m.group(3))
+        words.extend(WORD.findall(m.group(3)))  # resserre aussi via l'index GIN
+        return " "
+    rest = FIELD_TERM.sub(_field, text or "")
+    words.extend(WORD.findall(rest))
+    return list(dict.fromkeys(w.lower() for w in words)), fields
+
+
+def search_records(db, collection_ids, text, field_names=(), dates=(), page=0, page_size=25):
+    """Une page de résultats classés par pertinence puis date : (lignes, page suivante ?).
+
+    Les lignes ont la même forme que la liste paginée des dossiers :
+    id, collection_id, created_at, nom (+ rank).
+    """
+    words, fields = parse_query(text, field_names)
+    date_from = date_to = None
+    if len(dates) == 2:
+        date_from = datetime.combine(dates[0], time.min).isoformat()
+        date_to = datetime.combine(dates[1] + timedelta(days=1), time.min).isoformat()
+    rows = db.search_records(collection_ids, words, fields, date_from, date_to, limit=page_size + 1, offset=page * page_size)
+    return rows[:page_size], len(rows) > page_size
@@ -0,0 +1,279 @@
+"""Résolution SIRET -> raison sociale / adresse pour le remplissage automatique.
+
+Deux sources, par ordre de préférence :
+- un index SQLite local construit depuis l'export en masse SIRENE de l'INSEE
+  (`StockEtablissement`, et optionnellement `StockUniteLegale` pour les raisons sociales) ;
+- l'API recherche-entreprises.api.gouv.fr, via une session poolée avec timeouts,
+  reprises et un cache LRU à durée de vie.
+
+Construction de l'index (une fois, quelques minutes pour le stock complet) :
+
+    python -m crm.sirene build StockEtablissement_utf8.csv --unites StockUniteLegale_utf8.csv --out sirene.db
+"""
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from crm.http import make_session
+
+API_URL = "https://recherche-entreprises.api.gouv.fr/search"
+API_TIMEOUT = (3, 10)
+API_WORKERS = 4  # l'API publique limite le débit par IP
+CACHE_SIZE = 4096
+CACHE_TTL = 24 * 3600
+DEFAULT_INDEX = os.environ.get("SIRENE_INDEX", "sirene.db")
+BATCH_SIZE = 50_000
+
+
+class SireneError(Exception):
+    """Service de recherche indisponible (à distinguer d'un SIRET introuvable)."""
+
+
+def clean_siret(siret):
+    """SIRET sur 14 chiffres, ou None si la saisie n'en est pas un."""
+    digits = re.sub(r"\D", "", siret or "")
+    return digits if len(digits) == 14 else None
+
+
+LA_POSTE_SIREN = "356000000"
+
+
+def siret_checksum_ok(siret):
+    """Clé de Luhn d'un SIRET nettoyé ; les établissements de La Poste suivent une règle propre
+    (somme des chiffres multiple de 5)."""
+    if siret.startswith(LA_POSTE_SIREN) and siret != LA_POSTE_SIREN + "00048":
+        return sum(map(int, siret)) % 5 == 0
+    total = 0
+    for i, c in enumerate(reversed(siret)):
+        d = int(c) * (2 if i % 2 else 1)
+        total += d - 9 if d > 9 else d
+    return total % 10 == 0
+
+
+def _info(nom, adresse, ville, cp):
+    return {"NOM": nom, "ADRESSE": adresse, "VILLE": ville, "CP": cp}
+
+
+def autofill(fields, info):
+    """{nom de champ: valeur} à pré-remplir dans un modèle à partir d'une fiche SIRENE."""
+    out = {}
+    for f in fields:
+        fn_lower = f['name'].lower()
+        if f['type'] == 'SIRET': continue
+        elif f['type'] == 'Texte Court':
+            if any(x in fn_lower for x in ['raison', 'sociale', 'société', 'entreprise']):
+                out[f['name']] = info['NOM']
+        elif f['type'] == 'Adresse':
+            out[f['name']] = info['ADRESSE']
+        elif "ville" in fn_lower: out[f['name']] = info['VILLE']
+        elif "cp" in fn_lower or "postal" in fn_lower: out[f['name']] = info['CP']
+    return out
+
+
+# --- INDEX LOCAL ---
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS etab (siret INTEGER PRIMARY KEY, siren INTEGER, enseigne TEXT, adresse TEXT, ville TEXT, cp TEXT);
+CREATE TABLE IF NOT EXISTS unite (siren INTEGER PRIMARY KEY, nom TEXT);
+"""
+
+
+def _address(row):
+    parts = [row.get("numeroVoieEtablissement"), row.get("indiceRepetitionEtablissement"),
+             row.get("typeVoieEtablissement"), row.get("libelleVoieEtablissement"),
+             row.get("codePostalEtablissement"), row.get("libelleCommuneEtablissement")]
+    return " ".join(p for p in parts if p)
+
+
+def _unite_name(row):
+    nom = row.get("denominationUniteLegale")
+    if nom: return nom
+    return " ".join(p for p in [row.get("prenom1UniteLegale"), row.get("nomUniteLegale")] if p) or None
+
+
+def _bulk_insert(con, sql, rows):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= BATCH_SIZE:
+            con.executemany(sql, batch)
+            batch.clear()
+    if batch: con.executemany(sql, batch)
+
+
+def build_index(etab_csv, out_path, unites_csv=None, active_only=True):
+    """Construit l'index `out_path` depuis les CSV SIRENE (lecture en flux, insertion par lots)."""
+    tmp = out_path + ".tmp"
+    if os.path.exists(tmp): os.remove(tmp)
+    con = sqlite3.connect(tmp)
+    con.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + SCHEMA)
+    with open(etab_csv, newline="", encoding="utf-8") as fh:
+        rows = (
+            (int(r["siret"]), int(r["siren"]), r.get("enseigne1Etablissement") or r.get("denominationUsuelleEtablissement") or None,
+             _address(r), r.get("libelleCommuneEtablissement"), r.get("codePostalEtablissement"))
+            for r in csv.DictReader(fh)
+            if not active_only or r.get("etatAdministratifEtablissement", "A") == "A"
+        )
+        _bulk_insert(con, "INSERT OR REPLACE INTO etab VALUES (?, ?, ?, ?, ?, ?)", rows)
+    if unites_csv:
+        with open(unites_csv, newline="", encoding="utf-8") as fh:
+            rows = ((int(r["siren"]), _unite_name(r)) for r in csv.DictReader(fh))
+            _bulk_insert(con, "INSERT OR REPLACE INTO unite VALUES (?, ?)", rows)
+    con.commit()
+    con.execute("VACUUM")
+    con.close()
+    os.replace(tmp, out_path)
+    return out_path
+
+
+class SireneIndex:
+    """Lecture seule de l'index local ; partageable entre threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def lookup_many(self, sirets):
+        """{siret: info} pour les SIRET présents dans l'index (une seule requête)."""
+        keys = [int(s) for s in {clean_siret(s) for s in sirets} if s]
+        out = {}
+        for i in range(0, len(keys), 900):  # limite SQLite sur le nombre de paramètres
+            chunk = keys[i:i + 900]
+            with self.lock:
+                rows = self.con.execute(
+                    "SELECT e.siret, COALESCE(u.nom, e.enseigne), e.adresse, e.ville, e.cp FROM etab e "
+                    f"LEFT JOIN unite u ON u.siren = e.siren WHERE e.siret IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+            for siret, *info in rows: out[f"{siret:014d}"] = _info(*info)
+        return out
+
+    def lookup(self, siret):
+        s = clean_siret(siret)
+        return self.lookup_many([s]).get(s) if s else None
+
+
+# --- API EN LIGNE ---
+class TTLCache:
+    """LRU borné dont les entrées expirent après `ttl` secondes."""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize, self.ttl = maxsize, ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            hit = self.data.get(key)
+            if not hit: return None
+            if time.monotonic() - hit[0] > self.ttl:
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return hit
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic(), value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize: self.data.popitem(last=False)
+
+
+class SireneApi:
+    def __init__(self, session=None, cache=None):
+        self.session = session or make_session(API_WORKERS, retries=3, backoff=0.5)
+        self.cache = cache or TTLCache()
+
+    def lookup(self, siret):
+        s = clean_siret(siret)
+        if not s: return None
+        hit = self.cache.get(s)
+        if hit: return hit[1]
+        try:
+            res = self.session.get(API_URL, params={"q": s}, timeout=API_TIMEOUT)
+            res.raise_for_status()
+            results = res.json().get("results") or []
+        except (requests.RequestException, ValueError) as e:
+            raise SireneError(str(e)) from e
+        info = None
+        if results:
+            ent = results[0]
+            siege = ent.get("siege") or {}
+            # Le SIRET demandé peut être un établissement secondaire : on préfère son adresse à celle du siège
+            etab = next((m for m in ent.get("matching_etablissements") or [] if m.get("siret") == s), siege)
+            info = _info(ent.get("nom_complet"), etab.get("adresse"), etab.get("libelle_commune"), etab.get("code_postal"))
+        self.cache.set(s, info)  # les « introuvables » sont aussi mis en cache
+        return info
+
+    def _lookup_or_none(self, siret):
+        try: return self.lookup(siret)
+        except SireneError: return None
+
+    def lookup_many(self, sirets):
+        """Résolution parallèle ; un SIRET en échec est simplement absent du résultat."""
+        keys = sorted({s for s in map(clean_siret, sirets) if s})
+        with ThreadPoolExecutor(max_workers=API_WORKERS) as pool:
+            found = dict(zip(keys, pool.map(self._lookup_or_none, keys)))
+        return {k: v for k, v in found.items() if v}
+
+
+class SiretResolver:
+    """Index local si disponible, API sinon. Point d'entrée utilisé par l'application."""
+
+    def __init__(self, index_path=DEFAULT_INDEX, api=None):
+        self.index = SireneIndex(index_path) if index_path and os.path.exists(index_path) else None
+        self.api = api or SireneApi()
+
+    @property
+    def source(self):
+        return "index local" if self.index else "API"
+
+    def lookup(self, siret):
+        if self.index:
+            info = self.index.lookup(siret)
+            if info: return info
+        return self.api.lookup(siret)
+
+    def lookup_many(self, sirets):
+        """Résolution groupée (imports) : {siret: info}, les introuvables sont absents."""
+        sirets = [s for s in map(clean_siret, sirets) if s]
+        found = self.index.lookup_many(sirets) if self.index else {}
+        missing = [s for s in sirets if s not in found]
+        if missing: found.update(self.api.lookup_many(missing))
+        return found
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m crm.sirene")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="construire l'index local depuis l'export SIRENE")
+    b.add_argument("etablissements")
+    b.add_argument("--unites", help="StockUniteLegale (raisons sociales)")
+    b.add_argument("--out", default=DEFAULT_INDEX)
+    b.add_argument("--inclure-fermes", action="store_true", help="garder les établissements fermés")
+    q = sub.add_parser("lookup", help="tester une recherche")
+    q.add_argument("siret", nargs="+")
+    q.add_argument("--index", default=DEFAULT_INDEX)
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        build_index(args.etablissements, args.out, args.unites, active_only=not args.inclure_fermes)
+        print(f"Index {args.out} construit en {time.perf_counter() - t0:.0f} s ({os.path.getsize(args.out) / 1e6:.0f} Mo)")
+    else:
+        r = SiretResolver(args.index)
+        t0 = time.perf_counter()
+        found = r.lookup_many(args.siret)
+        print(f"[{r.source}] {len(found)}/{len(args.siret)} trouvés en {(time.perf_counter() - t0) * 1e3:.2f} ms")
+        for k, v in found.items(): print(k, v)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Envoi des pièces jointes vers le stockage du backend (Supabase Storage, ou dossier local en SQLite).
+
+Les fichiers sont rangés par contenu : `{entreprise}/{collection}/{sha256}{ext}`
+(bucket `fichiers` sur Supabase). Un fichier identique (Kbis, attestation d'assurance...)
+déjà présent n'est donc jamais renvoyé, et les envois se font en parallèle.
+Les images passent par `crm.images` : stockées normalisées en `{sha256}.jpg` (empreinte de
+l'original) avec leur miniature `{sha256}_thumb.webp`.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Optional
+
+from crm import images
+
+MAX_WORKERS = 4
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class UploadResult:
+    """Résultat d'un envoi : une instance par fichier, y compris en cas d'échec."""
+    name: str
+    path: Optional[str] = None
+    url: Optional[str] = None
+    skipped: bool = False  # contenu déjà présent, aucun transfert
+    error: Optional[str] = None
+    thumb_url: Optional[str] = None
+    size: int = 0    # octets reçus
+    stored: int = 0  # octets stockés (0 si déjà présent)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def content_hash(file):
+    """SHA-256 du fichier, lu par blocs pour ne pas dupliquer son contenu en mémoire."""
+    h = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        h.update(chunk)
+    file.seek(0)
+    return h.hexdigest()
+
+
+def content_path(file, company_id, collection_id):
+    ext = os.path.splitext(file.name)[1].lower()
+    return f"{company_id}/{collection_id}/{content_hash(file)}{ext}"
+
+
+def _upload_image(db, file, res, base):
+    """Image normalisée + miniature ; False si l'image n'est pas exploitable (envoi brut)."""
+    thumb = images.thumb_path(base + ".jpg")
+    # La miniature est envoyée en dernier : sa présence garantit celle de l'image
+    if db.file_exists(thumb):
+        res.path, res.skipped = base + ".jpg", True
+    else:
+        p = images.process(file.getvalue())
+        if not p: return False
+        res.path = base + p.ext
+        db.upload_file(res.path, p.content, p.content_type)
+        db.upload_file(thumb, p.thumb, "image/webp")
+        res.stored = len(p.content) + len(p.thumb)
+    res.thumb_url = db.public_url(thumb)
+    return True
+
+
+def upload_one(db, file, company_id, collection_id):
+    res = UploadResult(name=file.name, size=getattr(file, "size", 0))
+    try:
+        if not (images.is_image(file) and _upload_image(db, file, res, f"{company_id}/{collection_id}/{content_hash(file)}")):
+            res.path = content_path(file, company_id, collection_id)
+            if db.file_exists(res.path):
+                res.skipped = True
+            else:
+                content = file.getvalue()
+                db.upload_file(res.path, content, getattr(file, "type", None) or "application/octet-stream")
+                res.stored = len(content)
+        res.url = db.public_url(res.path)
+    except Exception as e:
+        res.error = str(e) or e.__class__.__name__
+    return res
+
+
+def upload_files(db, files, company_id, collection_id, max_workers=MAX_WORKERS, on_progress=None):
+    """Envoie `files` en parallèle (au plus `max_workers` à la fois).
+
+    Renvoie la liste des `UploadResult` dans l'ordre de `files`. `on_progress(done, total, result)`
+    est appelé depuis le thread appelant à chaque fichier terminé.
+    """
+    files = list(files or [])
+    results = [None] * len(files)
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as pool:
+        futures = {pool.submit(upload_one, db, f, company_id, collection_id): i for i, f in enumerate(files)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            results[futures[fut]] = fut.result()
+            if on_progress:
+                on_progress(done, len(files), results[futures[fut]])
+    return results
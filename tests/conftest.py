@@ -0,0 +1,36 @@
+import io
+import mimetypes
+
+import pytest
+
+from crm.data import SQLiteBackend
+
+
+class Upload(io.BytesIO):
+    """Fichier déposé, comme un `UploadedFile` de st.file_uploader (name, type, size, getvalue)."""
+
+    def __init__(self, content, name, type=None):
+        super().__init__(content)
+        self.name, self.size = name, len(content)
+        self.type = type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+@pytest.fixture
+def upload():
+    return Upload
+
+
+@pytest.fixture
+def fields():
+    """Champs du modèle créé par `db` ; un module de tests les redéfinit selon ses besoins."""
+    return [{"name": "nom", "type": "Texte Court"}]
+
+
+@pytest.fixture
+def db(tmp_path, fields):
+    """Backend SQLite jetable : entreprise 1, une activité, un modèle (`fields`)."""
+    db = SQLiteBackend(str(tmp_path / "crm.db"), str(tmp_path / "storage"))
+    db.con.execute("INSERT INTO companies (id, name) VALUES (1, 'A')")
+    db.add_activity(1, "act")
+    db.add_collection(1, "m", fields)
+    return db
@@ -0,0 +1,67 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from crm.data import SupabaseBackend
+
+
+class FakeAuth:
+    def __init__(self, log):
+        self.log, self.session = log, None
+
+    def _session(self, token, uid="u1", expires_in=3600):
+        self.session = SimpleNamespace(refresh_token=token, expires_at=time.time() + expires_in, user=SimpleNamespace(id=uid))
+        return SimpleNamespace(user=self.session.user, session=self.session)
+
+    def sign_in_with_password(self, creds):
+        self.log.append(("sign_in", id(self)))
+        return self._session("r1", expires_in=30)
+
+    def refresh_session(self, token):
+        self.log.append(("refresh", id(self), token))
+        return self._session(token + "+")
+
+    def sign_out(self, options=None):
+        self.log.append(("sign_out", id(self), options))
+
+
+class FakeClient:
+    def __init__(self, log):
+        self.auth = FakeAuth(log)
+
+
+@pytest.fixture
+def shared():
+    log = []
+    return SupabaseBackend(FakeClient(log), new_client=lambda: FakeClient(log)), log
+
+
+def test_sign_in_uses_a_client_per_user(shared):
+    db, log = shared
+    user, alice = db.sign_in("a@x", "pw")
+    _, bob = db.sign_in("b@x", "pw")
+    assert user.id == "u1" and alice.refresh_token == "r1"
+    assert db.client.auth.session is None and db.refresh_token is None
+    assert alice.client.auth is not bob.client.auth
+    bob.sign_out()
+    assert log[-1] == ("sign_out", id(bob.client.auth), {"scope": "local"}) and bob.refresh_token is None
+    assert alice.refresh_token == "r1"
+
+
+def test_keep_alive_adopts_token_rotated_by_another_tab(shared):
+    db, _ = shared
+    _, tab = db.sign_in("a@x", "pw")  # expire dans 30 s < REFRESH_MARGIN
+    assert tab.keep_alive("r-cookie") and tab.refresh_token == "r-cookie+"
+    assert not tab.keep_alive()  # jeton d'accès neuf : rien à faire
+
+
+def test_sqlite_sessions_are_independent(db):
+    db.add_profile({"id": "u1", "email": "a@x", "company_id": 1})
+    _, tab1 = db.sign_in("a@x", "")
+    _, tab2 = db.sign_in("a@x", "")
+    tab1.sign_out()
+    user, restored = db.refresh_session(tab2.refresh_token)
+    assert user.id == "u1" and restored.refresh_token not in (tab1.refresh_token, tab2.refresh_token, None)
+    with pytest.raises(ValueError):
+        db.refresh_session(tab2.refresh_token)  # usage unique
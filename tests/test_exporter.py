@@ -0,0 +1,30 @@
+import zipfile
+
+import pytest
+
+pytest.importorskip("requests")
+
+from crm import exporter
+from crm.http import make_session
+
+
+@pytest.fixture
+def fields():
+    return [{"name": "nom", "type": "Texte Court"}, {"name": "Pièces", "type": "Fichier/Image"}]
+
+
+def test_zip_export_includes_local_attachments(db):
+    db.upload_file("1/1/kbis.pdf", b"%PDF-1.4 kbis", "application/pdf")
+    db.insert_record(1, {"nom": "Dupont", "Pièces": [db.public_url("1/1/kbis.pdf")]})
+    path, count, missing = exporter.export_records(db, db.list_collections([1]), "zip")
+    with zipfile.ZipFile(path) as zf:
+        data = [zf.read(n) for n in zf.namelist() if n.endswith("kbis.pdf")]
+    assert (count, missing) == (1, 0) and data == [b"%PDF-1.4 kbis"]
+
+
+def test_file_urls_outside_storage_are_refused(db, tmp_path):
+    (tmp_path / "secret.txt").write_text("x")
+    s = make_session(file_root=db.file_root)
+    assert s.get((tmp_path / "secret.txt").as_uri()).status_code == 404
+    db.upload_file("1/1/a.txt", b"ok", "text/plain")
+    assert s.get(db.public_url("1/1/a.txt")).content == b"ok"
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from crm import importer
+
+FIELDS = [{"name": "nom", "type": "Texte Court"}, {"name": "SIRET", "type": "SIRET"}, {"name": "Ville", "type": "Texte Court"}]
+
+
+@pytest.fixture
+def fields():
+    return FIELDS
+
+
+def test_read_csv_from_french_excel(upload):
+    content = "nom;SIRET;Ville\nSociété Générale;552 120 222 00013;Épinal\n".encode("cp1252")
+    df = importer.read_table(upload(content, "clients.csv"))
+    assert list(df.columns) == ["nom", "SIRET", "Ville"]
+    assert df.iloc[0]["nom"] == "Société Générale" and df.iloc[0]["Ville"] == "Épinal"
+
+
+def test_read_csv_utf8_with_bom(upload):
+    df = importer.read_table(upload("\ufeffnom,Ville\nÉric,Lyon\n".encode("utf-8"), "c.csv"))
+    assert list(df.columns) == ["nom", "Ville"] and df.iloc[0]["nom"] == "Éric"
+
+
+def test_read_xlsx(upload):
+    pytest.importorskip("openpyxl")
+    buf = io.BytesIO()
+    pd.DataFrame({"nom": ["Dupont"], "SIRET": ["73282932000074"]}).to_excel(buf, index=False)
+    df = importer.read_table(upload(buf.getvalue(), "clients.xlsx"))
+    assert df.to_dict("records") == [{"nom": "Dupont", "SIRET": "73282932000074"}]
+
+
+def test_coerce_siret_checks_luhn_key():
+    assert importer.coerce("732 829 320 00074", "SIRET") == "73282932000074"
+    with pytest.raises(ValueError, match="clé"):
+        importer.coerce("73282932000075", "SIRET")
+    with pytest.raises(ValueError):
+        importer.coerce("7328293200007", "SIRET")
+
+
+def test_import_rows_rejects_and_resumes(db):
+    df = pd.DataFrame({"nom": ["a", "b", "c", "d", "e"], "SIRET": ["73282932000074", "73282932000075", "", "73282932000075", ""],
+                       "Ville": ["x", "y", "z", "t", "u"]})
+    mapping = importer.guess_mapping(df.columns, FIELDS)
+    insert, calls = db.insert_records, []
+
+    def flaky(rows):  # le deuxième lot échoue une fois
+        calls.append(rows)
+        if len(calls) == 2: raise RuntimeError("connexion perdue")
+        return insert(rows)
+
+    db.insert_records = flaky
+    rep = importer.import_rows(db, 1, "u", df, mapping, FIELDS, chunk_size=2)
+    assert not rep.done and rep.error == "connexion perdue" and rep.next_row == 2
+    assert rep.inserted == 1 and rep.errors == [(3, rep.errors[0][1])]  # rejets du lot en échec écartés
+    rep = importer.import_rows(db, 1, "u", df, mapping, FIELDS, start=rep.next_row, chunk_size=2, report=rep)
+    assert rep.done and rep.error is None and rep.inserted == 3 and [e[0] for e in rep.errors] == [3, 5]
+    assert db.count_records([1]) == 3
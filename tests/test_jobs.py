@@ -0,0 +1,183 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+from crm import images, jobs, metrics
+
+FIELDS = [{"name": "nom", "type": "Texte Court"}, {"name": "Kbis", "type": "Fichier/Image"},
+          {"name": "Photos", "type": "Fichier/Image"}]
+
+
+@pytest.fixture
+def fields():
+    return FIELDS
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+    return jobs.JobQueue(str(tmp_path / "jobs.db"))
+
+
+def collection_id(db):
+    return db.con.execute("SELECT id FROM collections").fetchone()[0]
+
+
+def new_record(db, data):
+    db.insert_records([{"collection_id": collection_id(db), "data": data, "created_by": None}])
+    return db.con.execute("SELECT max(id) FROM records").fetchone()[0]
+
+
+def names(db):
+    return sorted(json.loads(r[0])["nom"] for r in db.con.execute("SELECT data FROM records"))
+
+
+def run(queue, db, kind, params):
+    queue.submit(kind, 1, params)
+    job = queue.claim()
+    jobs.run_job(queue, job, db, None)
+    return queue.get(job["id"])
+
+
+def test_spooled_upload_is_a_real_file(queue, upload):
+    f = jobs.SpooledUpload(**jobs.spool([upload(b"abcdef", "kbis.pdf")])[0])
+    with f:
+        assert f.name == "kbis.pdf" and f.size == 6 and f.type == "application/pdf"
+        f.seek(2)
+        assert f.tell() == 2 and f.read() == b"cdef" and f.getvalue() == b"abcdef"
+
+
+def test_concurrent_uploads_keep_every_field(db, queue, upload):
+    rid = new_record(db, {"nom": "a"})
+    params = [{"files": jobs.spool([upload(f"{field}-{i}".encode(), f"{field}{i}.pdf") for i in range(3)]),
+               "company_id": 1, "collection_id": collection_id(db), "record_id": rid, "field": field}
+              for field in ("Kbis", "Photos")]
+    claimed = []
+    for p in params:
+        queue.submit("upload", 1, p)
+        claimed.append(queue.claim())
+    workers = [threading.Thread(target=jobs.run_job, args=(queue, j, db, None)) for j in claimed]
+    for w in workers: w.start()
+    for w in workers: w.join()
+    data = db.get_record(rid)["data"]
+    assert [queue.get(j["id"])["status"] for j in claimed] == ["done", "done"]
+    assert len(data["Kbis"]) == 3 and len(data["Photos"]) == 3 and data["nom"] == "a"
+
+
+def test_upload_rerun_adds_no_duplicate(db, queue, upload):
+    rid = new_record(db, {"Kbis": ["https://x/ancien.pdf"]})
+    for _ in range(2):
+        run(queue, db, "upload", {"files": jobs.spool([upload(b"kbis", "kbis.pdf")]), "company_id": 1,
+                                  "collection_id": collection_id(db), "record_id": rid, "field": "Kbis"})
+    urls = db.get_record(rid)["data"]["Kbis"]
+    assert len(urls) == 2 and urls[0] == "https://x/ancien.pdf"
+
+
+def test_upload_on_deleted_record_fails(db, queue, upload):
+    rid = new_record(db, {})
+    db.delete_record(rid)
+    job = run(queue, db, "upload", {"files": jobs.spool([upload(b"kbis", "kbis.pdf")]), "company_id": 1,
+                                    "collection_id": collection_id(db), "record_id": rid, "field": "Kbis"})
+    assert job["status"] == "failed" and "supprimé" in job["error"]
+
+
+def test_form_save_keeps_files_added_meanwhile(db):
+    rid = new_record(db, {"nom": "a", "Kbis": ["u1"]})
+    assert db.edit_files(rid, "Kbis", add=["u2"], thumbs={"u2": "t2"})
+    assert db.patch_record(rid, {"nom": "b"})
+    assert db.get_record(rid)["data"] == {"nom": "b", "Kbis": ["u1", "u2"], images.THUMBS_KEY: {"u2": "t2"}}
+    assert db.edit_files(rid, "Kbis", remove=["u2"])
+    assert db.get_record(rid)["data"] == {"nom": "b", "Kbis": ["u1"], images.THUMBS_KEY: {}}
+    assert not db.patch_record(rid + 1, {"nom": "c"})
+
+
+def import_params(db, file):
+    return {"file": jobs.spool([file])[0], "collection_id": collection_id(db), "user_id": None,
+            "mapping": {"nom": "nom", "Kbis": None, "Photos": None}, "fields": FIELDS}
+
+
+def test_xlsx_import_job(db, queue, upload):
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("openpyxl")
+    buf = io.BytesIO()
+    pd.DataFrame({"nom": ["Dupont", "Durand"]}).to_excel(buf, index=False)
+    job = run(queue, db, "import", import_params(db, upload(buf.getvalue(), "clients.xlsx")))
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["inserted"] == 2 and job["checkpoint"]["start"] == 2
+    assert names(db) == ["Dupont", "Durand"]
+
+
+def test_requeued_import_resumes_from_checkpoint(db, queue, upload):
+    pytest.importorskip("pandas")
+    queue.submit("import", 1, import_params(db, upload("nom\na\nb\nc\n".encode(), "clients.csv")))
+    job = queue.claim()
+    # Worker disparu après un premier lot de 2 lignes (une insérée, une rejetée)
+    queue.checkpoint(job["id"], {"start": 2, "inserted": 1, "errors": [[3, "rejetée"]]})
+    queue.requeue_stale(stale_after=-1)
+    job = queue.claim()
+    assert job["attempts"] == 2
+    jobs.run_job(queue, job, db, None)
+    job = queue.get(job["id"])
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["inserted"] == 2 and job["result"]["rejected"] == 1
+    assert names(db) == ["c"]
+
+
+def test_resumed_import_keeps_rows_of_the_failed_run(db, queue, monkeypatch, upload):
+    pytest.importorskip("pandas")
+    fields = [{"name": "nom", "type": "Texte Court"}, {"name": "SIRET", "type": "SIRET"}]
+    lines = [f"n{i};{'73282932000075' if i in (1, 700) else ''}" for i in range(1200)]  # 2 SIRET invalides
+    params = {**import_params(db, upload(("nom;SIRET\n" + "\n".join(lines) + "\n").encode(), "c.csv")),
+              "mapping": {"nom": "nom", "SIRET": "SIRET"}, "fields": fields}
+    insert, calls = db.insert_records, []
+
+    def flaky(rows):  # le deuxième lot (lignes 500 à 999) échoue une fois
+        calls.append(len(rows))
+        if len(calls) == 2: raise RuntimeError("connexion perdue")
+        return insert(rows)
+
+    monkeypatch.setattr(db, "insert_records", flaky)
+    failed = run(queue, db, "import", params)
+    assert failed["status"] == "failed" and failed["result"]["next_row"] == 500
+    assert (failed["result"]["inserted"], failed["result"]["rejected"]) == (499, 1)
+    job = run(queue, db, "import", jobs.resume_params(failed, **params, start=failed["result"]["next_row"]))
+    assert job["status"] == "done", job["error"]
+    assert (job["result"]["inserted"], job["result"]["rejected"]) == (1198, 2)
+    with open(job["result"]["path"], encoding="utf-8-sig") as fh:
+        assert [l.split(";")[0] for l in fh.read().splitlines()[1:]] == ["3", "702"]
+    assert len(names(db)) == 1198
+
+
+def test_heartbeat_while_handler_blocks(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_EVERY", 0.05)
+    seen = []
+
+    def slow(ctx):
+        before = queue.get(ctx.job["id"])["heartbeat"]
+        time.sleep(0.3)
+        seen.append(queue.get(ctx.job["id"])["heartbeat"] > before)
+        return {}
+
+    monkeypatch.setitem(jobs.HANDLERS, "slow", slow)
+    queue.submit("slow", 1, {})
+    jobs.run_job(queue, queue.claim(), None, None)
+    assert seen == [True]
+
+
+def test_job_metrics_count_rows_and_bytes(db, queue, upload):
+    rid = new_record(db, {})
+    before = metrics.prometheus_text()
+    run(queue, db, "upload", {"files": jobs.spool([upload(b"x" * 10, "a.pdf"), upload(b"y" * 5, "b.pdf")]),
+                              "company_id": 1, "collection_id": collection_id(db), "record_id": rid, "field": "Kbis"})
+    text = metrics.prometheus_text()
+
+    def total(name, op, target, t):
+        line = [l for l in t.splitlines() if l.startswith(f'{name}{{op="{op}",target="{target}"}}')]
+        return int(line[0].rsplit(" ", 1)[1]) if line else 0
+
+    assert total("crm_backend_rows_total", "job", "upload", text) - total("crm_backend_rows_total", "job", "upload", before) == 2
+    assert total("crm_backend_bytes_total", "job", "upload", text) - total("crm_backend_bytes_total", "job", "upload", before) == 15
+    assert total("crm_backend_bytes_total", "storage", "upload", text) - total("crm_backend_bytes_total", "storage", "upload", before) == 15
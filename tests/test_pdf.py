@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+pypdf = pytest.importorskip("pypdf")
+
+from crm.http import make_session
+from crm.pdf import PdfMergeEngine
+
+
+class Handler(SimpleHTTPRequestHandler):
+    down = set()
+
+    def do_GET(self):
+        if self.path.lstrip("/") in self.down: return self.send_error(503)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    for name in ("a.pdf", "b.pdf"):
+        w = pypdf.PdfWriter()
+        w.add_blank_page(width=200, height=200)
+        with open(tmp_path / name, "wb") as fh: w.write(fh)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=str(tmp_path)))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    Handler.down.clear()
+
+
+def pages(path):
+    return len(pypdf.PdfReader(path).pages)
+
+
+def test_partial_merge_is_not_cached(server, tmp_path):
+    engine = PdfMergeEngine(session=make_session(retries=0), cache_dir=str(tmp_path / "cache"))
+    urls = [f"{server}/a.pdf", f"{server}/b.pdf"]
+    Handler.down.add("b.pdf")
+    path, missing = engine.merge_to_file(urls)
+    assert missing == [urls[1]] and pages(path) == 1
+    assert engine.cached_path(urls) is None
+
+    Handler.down.clear()
+    path, missing = engine.merge_to_file(urls)
+    assert missing == [] and pages(path) == 2
+    assert engine.cached_path(urls) == path
+
+
+def test_downloads_keep_order_with_bounded_window(server, tmp_path):
+    engine = PdfMergeEngine(max_workers=2, cache_dir=None)
+    urls = [f"{server}/{n}" for n in ("a.pdf", "b.pdf") * 5]
+    got = []
+    for url, kind, fh in engine._downloads(urls):
+        got.append(url)
+        fh.close()
+    assert got == urls
+
+
+def test_merge_local_storage_urls(tmp_path):
+    w = pypdf.PdfWriter()
+    w.add_blank_page(width=200, height=200)
+    (tmp_path / "st").mkdir()
+    with open(tmp_path / "st" / "a.pdf", "wb") as fh: w.write(fh)
+    engine = PdfMergeEngine(cache_dir=None, file_root=str(tmp_path / "st"))
+    path, missing = engine.merge_to_file([(tmp_path / "st" / "a.pdf").as_uri()])
+    assert missing == [] and pages(path) == 1
+    assert not engine.is_cached(path)
+    os.remove(path)
+
+
+def test_uncached_merge_leaves_no_temp_file(tmp_path, monkeypatch):
+    w = pypdf.PdfWriter()
+    w.add_blank_page(width=200, height=200)
+    (tmp_path / "st").mkdir()
+    with open(tmp_path / "st" / "a.pdf", "wb") as fh: w.write(fh)
+    (tmp_path / "tmp").mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    engine = PdfMergeEngine(cache_dir=None, file_root=str(tmp_path / "st"))
+    assert engine.merge([(tmp_path / "st" / "a.pdf").as_uri()]).startswith(b"%PDF")
+    assert list((tmp_path / "tmp").iterdir()) == []
@@ -0,0 +1,34 @@
+import pytest
+
+from crm import search
+
+FIELDS = [{"name": "nom", "type": "Texte Court"}, {"name": "Ville", "type": "Texte Court"}]
+
+
+@pytest.fixture
+def fields():
+    return FIELDS
+
+
+def find(db, text):
+    rows, _ = search.search_records(db, [1], text, [f["name"] for f in FIELDS])
+    return sorted(r["nom"] for r in rows)
+
+
+@pytest.fixture
+def records(db):
+    for nom, ville in [("Élodie Martin", "Évry"), ("Dupontaxe", "Lyon"), ("dupont_x", "Lyon"), ("ÉRIC", "Paris")]:
+        db.insert_record(1, {"nom": nom, "Ville": ville})
+    return db
+
+
+def test_search_folds_non_ascii_case(records):
+    assert find(records, "élodie") == ["Élodie Martin"]
+    assert find(records, "ville:évry") == ["Élodie Martin"]
+    assert find(records, "Éric") == find(records, "éric") == ["ÉRIC"]
+
+
+def test_search_escapes_like_wildcards(records):
+    assert find(records, "dupont_x") == ["dupont_x"]
+    assert find(records, "nom:dupont_") == ["dupont_x"]
+    assert find(records, "dupont") == ["Dupontaxe", "dupont_x"]
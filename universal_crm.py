@@ -1,14 +1,12 @@
 import streamlit as st
-import pandas as pd
-import requests
 import json
 from datetime import datetime, timedelta
-import io
+import functools
+import os
 import time
 import re
-from supabase import create_client, Client
-from pypdf import PdfWriter, PdfReader
-from PIL import Image
+from crm import images, pdf, sirene, search, importer, exporter, jobs, metrics
+from crm.data import backend_from_env
 
 # Import Gestion des Cookies
 try:
@@ -27,18 +25,62 @@ except ImportError:
 # --- CONFIGURATION PAGE ---
 st.set_page_config(page_title="Universal CRM SaaS", page_icon="🚀", layout="wide")
 
-# --- INITIALISATION SUPABASE ---
+# --- INSTRUMENTATION ---
+@st.cache_resource
+def init_metrics():
+    return metrics.setup()
+
+init_metrics()
+metrics.start_rerun()
+metrics.mark("socle")  # connexion, session, barre latérale
+
+def rerun(scope="app"):
+    """st.rerun() en clôturant d'abord les mesures du rerun en cours."""
+    metrics.end_rerun()
+    st.rerun(scope=scope)
+
+def fragment(fn):
+    """st.fragment mesuré : un rerun limité au fragment ouvre son propre `Rerun`."""
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        cur = metrics.current()
+        own = cur is None or bool(cur.ms)  # rerun de l'app déjà clos : rerun du seul fragment
+        if own:
+            metrics.start_rerun(view=fn.__name__)
+            metrics.mark(fn.__name__)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if own: metrics.end_rerun()
+    return st.fragment(run)
+
+def stop():
+    metrics.end_rerun()
+    st.stop()
+
+# --- INITIALISATION BACKEND (Supabase, ou SQLite local si CRM_BACKEND=sqlite) ---
+def secret(name, default=None):
+    """Variable d'environnement, sinon `st.secrets` (absent en local sans secrets.toml)."""
+    if name in os.environ: return os.environ[name]
+    try: return st.secrets.get(name, default)
+    except FileNotFoundError: return default
+
+def supabase_client(key=None):
+    """Client neuf, sans session : le client partagé, puis un par utilisateur connecté (voir `crm.data`).
+    Pas de thread de rafraîchissement par client : la session est renouvelée au rerun (`keep_alive`)."""
+    from supabase import ClientOptions, create_client
+    return create_client(secret("SUPABASE_URL"), key or secret("SUPABASE_KEY"),
+                         ClientOptions(auto_refresh_token=False, persist_session=False))
+
 @st.cache_resource
 def init_connection():
     try:
-        url = st.secrets["SUPABASE_URL"]
-        key = st.secrets["SUPABASE_KEY"]
-        return create_client(url, key)
+        return backend_from_env(supabase_client)
     except Exception as e:
         st.error(f"Erreur connexion : {e}")
-        st.stop()
+        stop()
 
-supabase = init_connection()
+db = init_connection()  # backend partagé ; après connexion, `db` devient celui de l'utilisateur
 cookie_manager = stx.CookieManager()
 
 # --- ÉTAT SESSION ---
@@ -46,90 +88,299 @@ if 'user' not in st.session_state: st.session_state.user = None
 if 'profile' not in st.session_state: st.session_state.profile = None
 if 'form_reset_id' not in st.session_state: st.session_state.form_reset_id = 0
 if 'config_updater' not in st.session_state: st.session_state.config_updater = 0
+if 'q_cache' not in st.session_state: st.session_state.q_cache = {}
+if 'q_stats' not in st.session_state: st.session_state.q_stats = {"hit": 0, "miss": 0}
+# Compteurs du rerun courant (le cumul reste dans q_stats)
+st.session_state.q_rerun = {"hit": 0, "miss": 0}
+
+# --- CACHE DE REQUÊTES (session, par entreprise) ---
+CACHE_TTL = 120
+
+def cached_query(name, tenant, loader, ttl=CACHE_TTL):
+    """Résultat de `loader()` mis en cache sous (name, tenant) pendant `ttl` secondes."""
+    key = (name, tenant)
+    hit = st.session_state.q_cache.get(key)
+    if hit and time.time() - hit[0] < ttl:
+        kind = "hit"
+        val = hit[1]
+    else:
+        kind = "miss"
+        val = loader()
+        st.session_state.q_cache[key] = (time.time(), val)
+    st.session_state.q_stats[kind] += 1
+    st.session_state.q_rerun[kind] += 1
+    return val
+
+def invalidate(name, tenant):
+    """À appeler après chaque écriture touchant `name` pour ce tenant."""
+    st.session_state.q_cache.pop((name, tenant), None)
+
+def load_activities(company_id):
+    return cached_query("activities", company_id, lambda: db.list_activities(company_id))
+
+def load_collections(company_id):
+    """Toutes les collections de l'entreprise, en une requête (filtrées par activité côté app)."""
+    def _load():
+        return db.list_collections([a['id'] for a in load_activities(company_id)])
+    return cached_query("collections", company_id, _load)
+
+def load_profiles(company_id):
+    return cached_query("profiles", company_id, lambda: db.list_profiles(company_id))
+
+def load_companies():
+    return cached_query("companies", "*", lambda: db.list_companies())
 
 # --- FONCTION API SIRET ---
+@st.cache_resource
+def siret_resolver():
+    """Index SIRENE local si présent (secret SIRENE_INDEX ou ./sirene.db), API gouv.fr sinon."""
+    return sirene.SiretResolver(secret("SIRENE_INDEX", sirene.DEFAULT_INDEX))
+
 def get_siret_info(siret):
-    try:
-        clean_siret = siret.replace(' ', '').replace('.', '')
-        url = f"https://recherche-entreprises.api.gouv.fr/search?q={clean_siret}"
-        res = requests.get(url)
-        if res.status_code == 200:
-            data = res.json()
-            if data['results']:
-                ent = data['results'][0]
-                siege = ent.get('siege', {})
-                return {
-                    "NOM": ent.get('nom_complet'), 
-                    "ADRESSE": siege.get('adresse'),
-                    "VILLE": siege.get('libelle_commune'),
-                    "CP": siege.get('code_postal')
-                }
-    except: return None
-    return None
+    resolver = siret_resolver()
+    with metrics.timed("siret", resolver.source, siret) as c:
+        info = resolver.lookup(siret)
+        c.rows = int(bool(info))
+    return info
 
 # --- LOGIN & UTILS ---
-def login(email, password):
-    msg_box = st.empty()
-    login_success = False
+# Session persistante : le refresh token est gardé dans un cookie, le profil dans un cache serveur.
+# Chaque session Streamlit a son backend (`user_db`, sa session Supabase) : la connexion d'un
+# utilisateur ne change pas l'identité des autres, ni celle du backend partagé.
+SESSION_COOKIE = "crm_session"
+SESSION_DAYS = 30
+PROFILE_TTL = 600
+
+@st.cache_resource
+def profile_cache():
+    """{user_id: (horodatage, profil)}, partagé entre sessions : une session restaurée ne relit pas `profiles`."""
+    return {}
+
+def cached_profile(user_db, user_id):
+    hit = profile_cache().get(user_id)
+    if hit and time.time() - hit[0] < PROFILE_TTL: return hit[1]
+    prof = user_db.get_profile(user_id)
+    if prof: profile_cache()[user_id] = (time.time(), prof)
+    return prof
+
+def open_session(user, prof, user_db):
+    st.session_state.user = user
+    st.session_state.profile = prof
+    st.session_state.user_db = user_db
+    st.session_state.cookie_pending = True
+    st.session_state.pop('logged_out', None)
+
+def restore_session(refresh_token):
+    """Session reprise depuis le cookie : un appel auth, le profil vient du cache."""
     try:
-        res = supabase.auth.sign_in_with_password({"email": email, "password": password})
-        if res.user:
-            for _ in range(3):
-                p_res = supabase.table("profiles").select("*").eq("id", res.user.id).execute()
-                if p_res.data:
-                    st.session_state.user = res.user
-                    st.session_state.profile = p_res.data[0]
-                    login_success = True
-                    break
-                time.sleep(0.5)
-            if not login_success:
-                msg_box.error("Erreur : Profil introuvable (Délai dépassé).")
-    except Exception as e:
-        msg_box.error("Identifiants incorrects.")
+        user, user_db = db.refresh_session(refresh_token)
+    except Exception:
+        # Jeton expiré ou révoqué : cookie effacé, sans nouvelle tentative aux reruns suivants
+        st.session_state.cookie_pending = True
+        st.session_state.logged_out = True
+        return
+    prof = cached_profile(user_db, user.id)
+    if prof: open_session(user, prof, user_db)
 
-    if login_success:
-        msg_box.success("✅ Connexion réussie !")
-        time.sleep(0.5)
-        st.rerun()
+def write_session_cookie():
+    """Écrit le cookie quand le refresh token de cette session change (connexion, reprise, renouvellement),
+    l'efface à la déconnexion ; jamais à chaque rerun : deux onglets ne se le disputent pas."""
+    if not st.session_state.pop('cookie_pending', False): return
+    token = st.session_state.user_db.refresh_token if st.session_state.user else None
+    if token: cookie_manager.set(SESSION_COOKIE, token, expires_at=datetime.now() + timedelta(days=SESSION_DAYS), key="session_set")
+    elif cookie_manager.get(SESSION_COOKIE): cookie_manager.delete(SESSION_COOKIE, key="session_delete")
+
+def login(email, password):
+    try:
+        user, user_db = db.sign_in(email, password)
+    except Exception:
+        st.error("Identifiants incorrects.")
+        return
+    prof = user_db.get_profile(user.id)
+    if not prof:
+        user_db.sign_out()
+        st.error("Erreur : Profil introuvable.")
+        return
+    profile_cache()[user.id] = (time.time(), prof)
+    open_session(user, prof, user_db)
+    st.toast("✅ Connexion réussie !")
+    rerun()
 
 def logout():
-    supabase.auth.sign_out()
+    if st.session_state.get('user_db'): st.session_state.user_db.sign_out()  # cette session seulement
     st.session_state.user = None
     st.session_state.profile = None
-    st.rerun()
+    st.session_state.user_db = None
+    st.session_state.cookie_pending = True
+    st.session_state.logged_out = True  # le cookie encore lu ce rerun ne doit pas rouvrir la session
+    rerun()
 
-def upload_file(file, path):
-    try:
-        file_bytes = file.getvalue()
-        supabase.storage.from_("fichiers").upload(path, file_bytes, {"content-type": file.type, "upsert": "true"})
-        return supabase.storage.from_("fichiers").get_public_url(path)
-    except: return None
-
-def merge_files_to_pdf(file_urls):
-    merger = PdfWriter()
-    for url in file_urls:
-        try:
-            res = requests.get(url)
-            if res.status_code == 200:
-                f_data = io.BytesIO(res.content)
-                if url.lower().endswith('.pdf'):
-                    reader = PdfReader(f_data)
-                    for page in reader.pages: merger.add_page(page)
-                elif url.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    img = Image.open(f_data)
-                    if img.mode == 'RGBA': img = img.convert('RGB')
-                    img_pdf = io.BytesIO()
-                    img.save(img_pdf, format='PDF')
-                    img_pdf.seek(0)
-                    merger.add_page(PdfReader(img_pdf).pages[0])
-        except: continue
-    output = io.BytesIO()
-    merger.write(output)
-    return output.getvalue()
+# --- NAVIGATION DOSSIERS (pagination keyset) ---
+PAGE_SIZE = 25
+# Synchronisation incrémentale de la liste locale (RPC records_changes)
+SYNC_INTERVAL = 3  # secondes : les reruns plus rapprochés ne font aucune requête
+SYNC_MAX_ROWS = 200  # au-delà, rechargement complet de la liste
+# updated_at vaut now() au début de la transaction : une écriture peut être visible après une
+# autre plus récente. Chaque synchro relit donc les SYNC_LAG dernières secondes (idempotent).
+SYNC_LAG = 10
+
+def fetch_records_page(col_ids, cursor=None, limit=PAGE_SIZE):
+    """Page de dossiers triés par (created_at, id) décroissants, strictement après `cursor`."""
+    rows = db.records_page(col_ids, cursor, limit + 1)
+    return rows[:limit], len(rows) > limit
+
+def get_record(rid):
+    """Charge le `data` complet d'un seul dossier (celui sélectionné)."""
+    return db.get_record(rid)
+
+def _list_key(x):
+    # Horodatages ISO au même fuseau : l'ordre lexicographique est l'ordre chronologique
+    return (x['created_at'], x['id'])
+
+def record_browser(col_ids):
+    """Copie locale de la liste des dossiers pour la session, tenue à jour par `sync_record_browser`.
+
+    Reconstruite seulement si le périmètre de collections change.
+    """
+    key = tuple(sorted(col_ids))
+    b = st.session_state.get('rec_browser')
+    if not b or b['key'] != key:
+        wm = db.latest_change(key)
+        rows, more = fetch_records_page(list(key))
+        b = {"key": key, "rows": rows, "has_more": more, "page": 0, "watermark": wm, "synced_at": time.time()}
+        st.session_state.rec_browser = b
+    else:
+        sync_record_browser(b)
+    return b
+
+def sync_record_browser(b):
+    """Applique les créations / modifications / suppressions postérieures au watermark."""
+    if time.time() - b['synced_at'] < SYNC_INTERVAL: return
+    # Fraction de seconde ignorée (longueur variable selon Postgres) : fenêtre relue un peu plus large
+    since = datetime.fromisoformat(re.sub(r"\.\d+", "", b['watermark'])) - timedelta(seconds=SYNC_LAG)
+    changes = db.records_changes(b['key'], since.isoformat(), SYNC_MAX_ROWS + 1)
+    b['synced_at'] = time.time()
+    if not changes: return
+    if len(changes) > SYNC_MAX_ROWS:
+        wm = db.latest_change(b['key'])
+        rows, b['has_more'] = fetch_records_page(list(b['key']))
+        b.update(rows=rows, page=0, watermark=wm)
+        return
+    rows = {x['id']: x for x in b['rows']}
+    # Un dossier plus ancien que la dernière ligne chargée appartient à une page pas encore lue
+    floor = _list_key(b['rows'][-1]) if b['rows'] and b['has_more'] else None
+    for c in changes:
+        b['watermark'] = max(b['watermark'], c['changed_at'])
+        rows.pop(c['id'], None)
+        if not c['deleted'] and (floor is None or _list_key(c) >= floor):
+            rows[c['id']] = {k: c[k] for k in ("id", "collection_id", "created_at", "updated_at", "nom")}
+    b['rows'] = sorted(rows.values(), key=_list_key, reverse=True)
+    b['page'] = min(b['page'], max(len(b['rows']) - 1, 0) // PAGE_SIZE)
+
+def touch_record_browser():
+    """Après une écriture de la session : synchronisation immédiate au prochain rerun."""
+    b = st.session_state.get('rec_browser')
+    if b: b['synced_at'] = 0
+
+def reset_record_browser():
+    st.session_state.pop('rec_browser', None)
+
+@st.cache_resource
+def pdf_engine():
+    """Moteur de fusion partagé (session HTTP poolée + cache disque des PDF construits)."""
+    return pdf.PdfMergeEngine(file_root=init_connection().file_root)
+
+# --- TÂCHES DE FOND (fusion PDF, envois, import, export) ---
+JOBS_POLL = 2  # secondes entre deux rafraîchissements du panneau tant qu'une tâche est en cours
+JOB_ICONS = {jobs.QUEUED: "⏳", jobs.RUNNING: "⚙️", jobs.DONE: "✅", jobs.FAILED: "❌"}
+
+@st.cache_resource
+def worker_backend():
+    """Backend des workers. Sur Supabase, ils n'agissent au nom d'aucun utilisateur : les politiques
+    « authentifié » rejettent la clé anon seule, il leur faut `SUPABASE_SERVICE_KEY` (service_role).
+    Sans elle : None, pas de worker dans ce processus."""
+    shared = init_connection()
+    if shared.name == "sqlite": return shared
+    key = secret("SUPABASE_SERVICE_KEY")
+    return backend_from_env(lambda: supabase_client(key)) if key else None
+
+@st.cache_resource
+def job_queue():
+    """File partagée ; workers dans ce processus sauf si CRM_JOBS_THREADS=0 ou, sur Supabase, sans clé
+    service_role (`python -m crm.jobs worker` à part)."""
+    queue = jobs.JobQueue()
+    threads = int(os.environ.get("CRM_JOBS_THREADS", jobs.THREADS))
+    backend = worker_backend() if threads else None
+    if backend:
+        engine = pdf_engine()
+        jobs.start_workers(queue, backend, threads, engine_factory=lambda: engine)
+    return queue
+
+def submit_job(kind, params, label):
+    """Met une tâche en file pour l'entreprise courante ; le panneau Tâches prend le relais."""
+    job_id = job_queue().submit(kind, MY_COMPANY_ID, params, owner=st.session_state.user.id, label=label)
+    st.session_state.jobs_active = st.session_state.get('jobs_active', set()) | {job_id}
+    st.toast(f"⏳ {label} : tâche lancée")
+    return job_id
+
+def read_file(path):
+    """`data` différé de st.download_button : le fichier n'est lu qu'au clic, pas à chaque rerun."""
+    def data():
+        with open(path, "rb") as fh: return fh.read()
+    return data
+
+def _jobs_panel():
+    q = job_queue()
+    my_jobs = q.list(st.session_state.user.id, limit=5)
+    active = {j['id'] for j in my_jobs if j['status'] in jobs.ACTIVE}
+    ended = [j for j in my_jobs if j['id'] in st.session_state.get('jobs_active', set()) - active]
+    st.session_state.jobs_active = active
+    if any(j['kind'] in ("upload", "import") for j in ended):
+        # Données modifiées par la tâche : rerun complet pour les afficher
+        touch_record_browser()
+        rerun()
+    elif ended and not active:
+        rerun()  # arrêt du rafraîchissement périodique
+    if not my_jobs: return
+    st.markdown("**Tâches**")
+    for j in my_jobs:
+        res = j['result'] or {}
+        st.caption(f"{JOB_ICONS[j['status']]} {j['label']}")
+        if j['status'] == jobs.RUNNING: st.progress(j['progress'], text=j['message'] or "")
+        elif j['status'] == jobs.QUEUED: st.caption(f"En attente ({q.position(j['id'])} tâche(s) avant)")
+        elif j['status'] == jobs.FAILED: st.error(j['error'])
+        if res.get('summary'): st.caption(res['summary'])
+        c1, c2 = st.columns([4, 1])
+        if res.get('path') and os.path.exists(res['path']):
+            c1.download_button(f"📥 {res['filename']}", read_file(res['path']), res['filename'], res.get('mime'), key=f"job_dl_{j['id']}")
+        if j['id'] not in active: c2.button("✖", key=f"job_x_{j['id']}", on_click=q.dismiss, args=(j['id'],))
+
+def jobs_panel():
+    """Tâches de l'utilisateur (retrouvées après un rafraîchissement), actualisées tant qu'une tâche tourne."""
+    if 'jobs_active' not in st.session_state:
+        st.session_state.jobs_active = {j['id'] for j in job_queue().list(st.session_state.user.id, limit=5) if j['status'] in jobs.ACTIVE}
+    st.fragment(run_every=JOBS_POLL if st.session_state.get('jobs_active') else None)(_jobs_panel)()
 
 # ==========================================
 # 🔐 LOGIN
 # ==========================================
+if not st.session_state.user and not st.session_state.get('logged_out'):
+    token = cookie_manager.get(SESSION_COOKIE)
+    if token:
+        restore_session(token)
+    elif not cookie_manager.cookies and 'cookies_read' not in st.session_state:
+        # Premier rerun de la session : le composant n'a pas encore renvoyé les cookies du navigateur
+        st.session_state.cookies_read = True
+        stop()
+if st.session_state.user:
+    db = st.session_state.user_db
+    try:
+        # Jeton d'accès renouvelé : nouveau refresh token, à écrire dans le cookie
+        if db.keep_alive(cookie_manager.get(SESSION_COOKIE)): st.session_state.cookie_pending = True
+    except Exception:
+        logout()  # session révoquée (déconnexion dans un autre onglet) : retour à la connexion
+write_session_cookie()
+
 if not st.session_state.user:
     st.markdown("<h1 style='text-align: center;'>🔐 Connexion CRM</h1>", unsafe_allow_html=True)
     c1, c2, c3 = st.columns([1, 2, 1])
@@ -139,7 +390,7 @@ if not st.session_state.user:
             pw = st.text_input("Mot de passe", type="password")
             if st.form_submit_button("Se connecter", use_container_width=True):
                 login(em, pw)
-    st.stop()
+    stop()
 
 # ==========================================
 # 🚀 APP
@@ -148,7 +399,7 @@ MY_PROFILE = st.session_state.profile
 if not MY_PROFILE: 
     st.warning("Session expirée.")
     if st.button("Recharger"): logout()
-    st.stop()
+    stop()
 
 MY_ROLE = MY_PROFILE.get('role', 'user')
 MY_COMPANY_ID = MY_PROFILE.get('company_id')
@@ -157,37 +408,120 @@ with st.sidebar:
     st.markdown(f"### 👋 {MY_PROFILE.get('full_name')}")
     st.info(f"Rôle : {MY_ROLE.upper()}")
     if st.button("Se déconnecter", type="primary", use_container_width=True): logout()
+    cache_box = st.empty()
+    jobs_box = st.container()
+    show_prof = MY_ROLE in ["admin1", "super_admin"] and st.checkbox("🔬 Profilage des requêtes", key="show_prof")
+    prof_box = st.container()
 
 # --- SUPER ADMIN ---
+DASHBOARD_TTL = 60
+DASHBOARD = "📊 Tableau de bord"
+
+def dashboard(names):
+    """Vue multi-entreprises : lit les cumuls tenus par triggers, jamais les dossiers."""
+    rows = cached_query("tenant_overview", "*", db.tenant_overview, ttl=DASHBOARD_TTL)
+    tot = lambda k: sum(r[k] or 0 for r in rows)
+    m = st.columns(5)
+    m[0].metric("Entreprises", len(rows))
+    m[1].metric("Dossiers", f"{tot('records'):,}".replace(",", " "))
+    m[2].metric("Créés (7 j)", tot('created_7d'))
+    m[3].metric("Utilisateurs", tot('users'))
+    m[4].metric("Stockage", f"{tot('storage_bytes') / 1e9:.2f} Go")
+    st.dataframe([{**r, "storage_bytes": round((r['storage_bytes'] or 0) / 1e6, 1)} for r in rows], hide_index=True,
+                 use_container_width=True, column_order=["name", "records", "created_7d", "collections", "activities",
+                                                         "users", "active_users_30d", "files", "storage_bytes"],
+                 column_config={"name": "Entreprise", "records": "Dossiers", "created_7d": "Créés (7 j)",
+                                "collections": "Modèles", "activities": "Activités", "users": "Utilisateurs",
+                                "active_users_30d": "Actifs (30 j)", "files": "Fichiers", "storage_bytes": "Stockage (Mo)"})
+    cid = st.selectbox("Détail", [None] + [r['company_id'] for r in rows], format_func=lambda i: "Choisir..." if i is None else names.get(i, i))
+    if cid is not None:
+        c1, c2 = st.columns([3, 2])
+        c1.dataframe(cached_query("tenant_collections", cid, lambda: db.tenant_collections(cid), ttl=DASHBOARD_TTL),
+                     hide_index=True, use_container_width=True,
+                     column_config={"activity": "Activité", "collection": "Modèle", "records": "Dossiers", "created_30d": "Créés (30 j)"})
+        daily = cached_query("tenant_daily", cid, lambda: db.tenant_daily(cid), ttl=DASHBOARD_TTL)
+        if daily: c2.bar_chart(daily, x="day", y="n", x_label="Jour", y_label="Créations")
+        else: c2.caption("Aucune création sur 90 jours.")
+    metrics.mark("dashboard")
+
 if MY_ROLE == "super_admin":
-    all_c = supabase.table("companies").select("*").execute().data
-    target = st.selectbox("🏢 Entreprise cible :", ["Choisir..."] + [c['name'] for c in all_c])
-    if target != "Choisir...":
-        MY_COMPANY_ID = next(c['id'] for c in all_c if c['name'] == target)
+    company_names = {c['id']: c['name'] for c in load_companies()}
+    target = st.selectbox("🏢 Entreprise cible :", [DASHBOARD] + list(company_names),
+                          format_func=lambda i: i if i == DASHBOARD else company_names[i])
+    if target != DASHBOARD:
+        MY_COMPANY_ID = target
     else:
-        st.info("👈 Sélectionnez une entreprise.")
-        st.stop()
+        dashboard(company_names)
+        stop()
+
+# --- NAVIGATION ---
+# Contrairement à st.tabs, qui exécute le corps de tous les onglets à chaque rerun,
+# seule la vue sélectionnée est exécutée (voir VIEWS en fin de fichier).
+views = ["1. 📝 Nouveau Dossier", "2. 📂 Gestion des Dossiers"]
+if MY_ROLE in ["admin1", "super_admin"]: views.append("3. ⚙️ Configuration")
+if MY_ROLE in ["admin1", "admin2", "super_admin"]: views.append("4. 👥 Utilisateurs")
+if st.session_state.get('view') not in views: st.session_state.view = views[0]
+view = st.radio("Vue", views, horizontal=True, key="view", label_visibility="collapsed")
 
-# --- ONGLETS ---
-tabs_list = ["1. 📝 Nouveau Dossier", "2. 📂 Gestion des Dossiers"]
-if MY_ROLE in ["admin1", "super_admin"]: tabs_list.append("3. ⚙️ Configuration")
-if MY_ROLE in ["admin1", "admin2", "super_admin"]: tabs_list.append("4. 👥 Utilisateurs")
-tabs = st.tabs(tabs_list)
+# --- IMPORT EN MASSE ---
+def import_panel(mod):
+    up = st.file_uploader("Fichier CSV ou Excel", type=["csv", "xlsx"], key=f"imp_file_{mod['id']}")
+    if not up: return
+    sig = (mod['id'], up.file_id)
+    if st.session_state.get('imp_sig') != sig:
+        try: df = importer.read_table(up)
+        except ImportError:
+            st.error("⚠️ Librairie manquante : 'openpyxl' (import Excel).")
+            return
+        except Exception as e:
+            st.error(f"Fichier illisible : {e}")
+            return
+        st.session_state.imp_sig, st.session_state.imp_df, st.session_state.imp_job = sig, df, None
+    df = st.session_state.imp_df
+    st.caption(f"{len(df)} lignes, {len(df.columns)} colonnes")
+    st.dataframe(df.head(10), use_container_width=True)
 
-# ONGLET 1 : CRÉATION
-with tabs[0]:
+    st.markdown("**Correspondance des colonnes**")
+    guess = importer.guess_mapping(df.columns, mod['fields'])
+    choices = ["—"] + list(df.columns)
+    mapping, grid = {}, st.columns(3)
+    for i, f in enumerate(importer.importable_fields(mod['fields'])):
+        c = grid[i % 3].selectbox(f"{f['name']} [{f['type']}]", choices, index=choices.index(guess[f['name']]) if guess[f['name']] else 0, key=f"imp_map_{mod['id']}_{i}")
+        mapping[f['name']] = None if c == "—" else c
+    enrich = any(f['type'] == "SIRET" and mapping.get(f['name']) for f in mod['fields']) and st.checkbox("Compléter les champs vides via SIRENE", key=f"imp_enrich_{mod['id']}")
+
+    # Import exécuté en tâche de fond ; un import interrompu reprend au premier lot non inséré
+    job = job_queue().get(st.session_state.imp_job) if st.session_state.get('imp_job') else None
+    res = (job or {}).get('result') or {}
+    resume = job is not None and job['status'] == jobs.FAILED and res.get('next_row', 0) < res.get('total', 0)
+    if job and job['status'] in jobs.ACTIVE:
+        st.info("Import en cours : suivez sa progression dans le panneau **Tâches**.")
+    elif st.button(f"▶️ Reprendre à la ligne {res['next_row'] + 2}" if resume else "📥 Importer", type="primary", key=f"imp_go_{mod['id']}"):
+        params = {"file": res['file'] if resume else jobs.spool([up])[0], "collection_id": mod['id'], "user_id": st.session_state.user.id,
+                  "mapping": mapping, "fields": mod['fields'], "start": res['next_row'] if resume else 0,
+                  "sirene_index": secret("SIRENE_INDEX", sirene.DEFAULT_INDEX) if enrich else None}
+        if resume: params = jobs.resume_params(job, **params)  # + lignes insérées et rejetées avant l'échec
+        st.session_state.imp_job = submit_job("import", params, f"Import {up.name} → {mod['name']}")
+        rerun()
+
+# VUE 1 : CRÉATION
+def view_creation():
+    metrics.mark("nouveau")
     st.header("Créer un dossier")
-    acts = supabase.table("activities").select("*").eq("company_id", MY_COMPANY_ID).execute().data
+    acts = load_activities(MY_COMPANY_ID)
     if acts:
         act_sel = st.selectbox("Activité", [a['name'] for a in acts])
         act_id = next(a['id'] for a in acts if a['name'] == act_sel)
-        cols = supabase.table("collections").select("*").eq("activity_id", act_id).execute().data
+        cols = [c for c in load_collections(MY_COMPANY_ID) if c['activity_id'] == act_id]
         if cols:
             opts = [f"{c['name']} (ID: {c['id']})" for c in cols]
             choice = st.selectbox("Modèle", opts, key="sel_model_creation")
             sel_id = int(choice.split("(ID: ")[1][:-1])
             mod = next(c for c in cols if c['id'] == sel_id)
             f_id = st.session_state.form_reset_id
+
+            with st.expander("📥 Import en masse (CSV / Excel)"):
+                import_panel(mod)
             
             # --- AUTO FILL SIRET (V59/V60 Strict) ---
             if any(f['type'] == "SIRET" for f in mod['fields']):
@@ -195,24 +529,17 @@ with tabs[0]:
                     c_siret, c_btn = st.columns([3, 1])
                     siret_input = c_siret.text_input("Entrez le SIRET", key="auto_siret_in")
                     if c_btn.button("Remplir"):
-                        info = get_siret_info(siret_input)
+                        try: info, err = get_siret_info(siret_input), "SIRET introuvable."
+                        except sirene.SireneError: info, err = None, "Service SIRET indisponible, réessayez plus tard."
                         if info:
                             st.success("Entreprise trouvée !")
+                            filled = sirene.autofill(mod['fields'], info)
                             for i, f in enumerate(mod['fields']):
                                 k = f"f_{mod['id']}_{i}_{f['name']}_{f_id}"
-                                fn_lower = f['name'].lower()
-                                
-                                if f['type'] == 'SIRET': 
-                                    st.session_state[k] = siret_input
-                                elif f['type'] == 'Texte Court':
-                                    if any(x in fn_lower for x in ['raison', 'sociale', 'société', 'entreprise']):
-                                         st.session_state[k] = info['NOM']
-                                elif f['type'] == 'Adresse': 
-                                    st.session_state[k] = info['ADRESSE']
-                                elif "ville" in fn_lower: st.session_state[k] = info['VILLE']
-                                elif "cp" in fn_lower or "postal" in fn_lower: st.session_state[k] = info['CP']
+                                if f['type'] == 'SIRET': st.session_state[k] = siret_input
+                                elif f['name'] in filled: st.session_state[k] = filled[f['name']]
                         else:
-                            st.error("SIRET introuvable.")
+                            st.error(err)
 
             st.divider()
             data, f_map = {}, {}
@@ -255,169 +582,287 @@ with tabs[0]:
                     data[f['name']] = st.text_input(f['name'], key=k)
 
             if st.button("💾 ENREGISTRER", type="primary"):
+                # Dossier créé tout de suite ; les pièces jointes suivent en tâche de fond
+                for fn in f_map: data[fn] = []
+                rid = db.insert_record(mod['id'], data, st.session_state.user.id)
                 for fn, fl in f_map.items():
-                    urls = [upload_file(fi, f"{MY_COMPANY_ID}/{mod['id']}/{int(time.time())}_{fi.name}") for fi in fl]
-                    data[fn] = [u for u in urls if u]
-                supabase.table("records").insert({"collection_id": mod['id'], "data": data, "created_by": st.session_state.user.id}).execute()
+                    if fl: submit_job("upload", {"files": jobs.spool(fl), "company_id": MY_COMPANY_ID, "collection_id": mod['id'],
+                                                 "record_id": rid, "field": fn}, f"{len(fl)} fichier(s) → #{rid} / {fn}")
+                touch_record_browser()
                 st.session_state.form_reset_id += 1
-                st.success("Dossier créé !")
-                time.sleep(1)
-                st.rerun()
+                st.toast("Dossier créé !")
+                rerun()
+
+# --- ÉDITION D'UN DOSSIER (fragment : ses interactions ne relancent que lui) ---
+THUMB_COLUMNS = 4
+
+@fragment
+def dossier_editor(rid, col_map):
+    r = get_record(rid)
+    if not r: return
+    fields = col_map[r['collection_id']]['fields']
+    with st.form(f"edit_{r['id']}"):
+        # Seuls les champs du formulaire sont écrits : les fichiers ajoutés entre-temps par une tâche restent
+        patch = {}
+        for f in fields:
+            if f['type'] not in ["Fichier/Image", "Section/Titre"]:
+                if f['type'] == "Texte Long": patch[f['name']] = st.text_area(f['name'], value=r['data'].get(f['name'], ""))
+                else: patch[f['name']] = st.text_input(f['name'], value=r['data'].get(f['name'], ""))
+        if st.form_submit_button("💾 Sauvegarder"):
+            db.patch_record(r['id'], patch)
+            touch_record_browser()
+            st.toast("Sauvegardé")
+            rerun(scope="fragment")
+
+    st.divider()
+    all_urls = []
+    thumbs = r['data'].get(images.THUMBS_KEY) or {}
+    for f in [x for x in fields if x['type'] == "Fichier/Image"]:
+        fname = f['name']
+        urls = r['data'].get(fname, [])
+        all_urls.extend(urls)
+        with st.expander(f"📁 {fname} ({len(urls)})"):
+            # Images : grille de miniatures (quelques Ko chacune) ; autres fichiers : liens
+            grid = st.columns(THUMB_COLUMNS)
+            for i, u in enumerate(urls):
+                if thumbs.get(u):
+                    c1 = c2 = grid[i % THUMB_COLUMNS]
+                    c1.image(thumbs[u], width=images.THUMB_SIDE // 2)
+                    c1.markdown(f"[Fichier {i+1}]({u})")
+                else:
+                    c1, c2 = st.columns([4, 1])
+                    c1.markdown(f"📄 [Lien fichier {i+1}]({u})")
+                if c2.button("❌", key=f"d_{r['id']}_{fname}_{i}"):
+                    db.edit_files(r['id'], fname, remove=[u])
+                    rerun(scope="fragment")
+            up = st.file_uploader("Ajouter", accept_multiple_files=True, key=f"up_{r['id']}_{fname}")
+            if up and st.button("Envoyer", key=f"send_{r['id']}_{fname}"):
+                submit_job("upload", {"files": jobs.spool(up), "company_id": MY_COMPANY_ID, "collection_id": r['collection_id'],
+                                      "record_id": r['id'], "field": fname}, f"{len(up)} fichier(s) → #{r['id']} / {fname}")
+                rerun()  # le panneau Tâches commence à se rafraîchir
+
+    if all_urls:
+        # PDF déjà construit (même liste de pièces) : servi directement, sinon fusion en tâche de fond
+        cached = pdf_engine().cached_path(all_urls)
+        if cached:
+            st.download_button("📥 PDF COMPLET", read_file(cached), f"Dossier_{r['id']}.pdf", "application/pdf")
+        elif st.button("📄 PDF COMPLET"):
+            submit_job("pdf_merge", {"urls": all_urls, "record_id": r['id']}, f"PDF du dossier #{r['id']}")
+            rerun()
+
+    if st.button("💀 Supprimer", type="primary"):
+        db.delete_record(r['id'])
+        touch_record_browser()
+        st.toast("Supprimé")
+        rerun()  # la liste change : rerun complet
 
-# ONGLET 2 : GESTION
-with tabs[1]:
+# VUE 2 : GESTION
+def view_records():
+    metrics.mark("gestion")
     st.header("Gestion des Dossiers")
-    m_acts = supabase.table("activities").select("id").eq("company_id", MY_COMPANY_ID).execute().data
+    m_acts = load_activities(MY_COMPANY_ID)
     if m_acts:
-        a_cols = supabase.table("collections").select("*").in_("activity_id", [a['id'] for a in m_acts]).execute().data
+        a_cols = load_collections(MY_COMPANY_ID)
         if a_cols:
-            recs = supabase.table("records").select("*, collections(name, fields)").in_("collection_id", [c['id'] for c in a_cols]).order('created_at', desc=True).execute().data
-            if recs:
-                s_map = {f"👤 {r['data'].get('nom', 'Dossier')} | 📄 {r['collections']['name']}": r for r in recs}
-                sel_label = st.selectbox("Choisir dossier", list(s_map.keys()))
-                if sel_label:
-                    r = s_map[sel_label]
-                    with st.form(f"edit_{r['id']}"):
-                        new_d = r['data'].copy()
-                        for f in r['collections']['fields']:
-                            if f['type'] not in ["Fichier/Image", "Section/Titre"]:
-                                if f['type'] == "Texte Long": new_d[f['name']] = st.text_area(f['name'], value=r['data'].get(f['name'], ""))
-                                else: new_d[f['name']] = st.text_input(f['name'], value=r['data'].get(f['name'], ""))
-                        if st.form_submit_button("💾 Sauvegarder"):
-                            supabase.table("records").update({"data": new_d}).eq("id", r['id']).execute()
-                            st.success("Sauvegardé")
-                            st.rerun()
-
-                    st.divider()
-                    all_urls = []
-                    for f in [x for x in r['collections']['fields'] if x['type'] == "Fichier/Image"]:
-                        fname = f['name']
-                        urls = r['data'].get(fname, [])
-                        all_urls.extend(urls)
-                        with st.expander(f"📁 {fname} ({len(urls)})"):
-                            for i, u in enumerate(urls):
-                                c1, c2 = st.columns([4, 1])
-                                c1.markdown(f"📄 [Lien fichier {i+1}]({u})")
-                                if c2.button("❌", key=f"d_{r['id']}_{fname}_{i}"):
-                                    urls.remove(u)
-                                    r['data'][fname] = urls
-                                    supabase.table("records").update({"data": r['data']}).eq("id", r['id']).execute()
-                                    st.rerun()
-                            up = st.file_uploader("Ajouter", key=f"up_{r['id']}_{fname}")
-                            if up and st.button("Envoyer", key=f"send_{r['id']}_{fname}"):
-                                pub = upload_file(up, f"{MY_COMPANY_ID}/{r['collection_id']}/{int(time.time())}_{up.name}")
-                                if pub:
-                                    urls.append(pub)
-                                    r['data'][fname] = urls
-                                    supabase.table("records").update({"data": r['data']}).eq("id", r['id']).execute()
-                                    st.success("Ajouté")
-                                    time.sleep(1)
-                                    st.rerun()
-                    
-                    if all_urls and st.button("📄 PDF COMPLET"):
-                        st.download_button("📥 Télécharger", merge_files_to_pdf(all_urls), f"Dossier_{r['id']}.pdf", "application/pdf")
-                    
-                    if st.button("💀 Supprimer", type="primary"):
-                        supabase.table("records").delete().eq("id", r['id']).execute()
-                        st.success("Supprimé")
-                        time.sleep(1)
-                        st.rerun()
-            else: st.info("Aucun dossier.")
-
-# ONGLET 3 : CONFIGURATION
-if "3. ⚙️ Configuration" in tabs_list:
-    idx = tabs_list.index("3. ⚙️ Configuration")
-    with tabs[idx]:
-        st.header("⚙️ Configuration")
-        with st.form("na"):
-            n = st.text_input("Nouvelle activité")
-            if st.form_submit_button("Ajouter"):
-                supabase.table("activities").insert({"name": n, "company_id": MY_COMPANY_ID}).execute()
-                st.rerun()
-        
-        st.divider()
-        acts = supabase.table("activities").select("*").eq("company_id", MY_COMPANY_ID).execute().data
-        if acts:
-            aid = next(a['id'] for a in acts if a['name'] == st.selectbox("Activité :", [a['name'] for a in acts]))
-            type_list = ["Texte Court", "Texte Long", "SIRET", "Adresse", "Adresse Travaux", "Fichier/Image", "Section/Titre"]
-            
-            with st.expander("➕ Créer Modèle"):
-                nm = st.text_input("Nom du modèle")
-                c1, c2, c3 = st.columns([3, 2, 1])
-                fn = c1.text_input("Nom champ", key="new_fn")
-                ft = c2.selectbox("Type", type_list, key="new_ft")
-                if c3.button("Ajouter à la liste", key="add_to_list"):
-                    if "t" not in st.session_state: st.session_state.t = []
-                    st.session_state.t.append({"name": fn, "type": ft})
-                    st.rerun()
-                if "t" in st.session_state and st.session_state.t:
-                    st.write(st.session_state.t)
-                    if st.button("💾 SAUVEGARDER"):
-                        supabase.table("collections").insert({"name": nm, "activity_id": aid, "fields": st.session_state.t}).execute()
-                        st.session_state.t = []
-                        st.success("Créé !")
-                        st.rerun()
-
-            models_data = supabase.table("collections").select("*").eq("activity_id", aid).execute().data
-            for m in models_data:
-                with st.expander(f"📝 Gérer {m['name']}"):
-                    st.markdown("#### Ajouter un champ")
-                    ca1, ca2, ca3 = st.columns([3, 2, 1])
-                    new_field_name = ca1.text_input("Nom", key=f"n_{m['id']}")
-                    new_field_type = ca2.selectbox("Type", type_list, key=f"t_{m['id']}")
-                    if ca3.button("Ajouter", key=f"add_{m['id']}"):
-                        if new_field_name:
-                            nf = m['fields'] + [{"name": new_field_name, "type": new_field_type}]
-                            supabase.table("collections").update({"fields": nf}).eq("id", m['id']).execute()
-                            st.success("Champ ajouté !")
-                            st.session_state.config_updater += 1
-                            time.sleep(1.5)
-                            st.rerun()
-                    
-                    st.divider()
-                    st.markdown("#### Trier / Supprimer")
-                    fl = [f"{f['name']} [{f['type']}]" for f in m['fields']]
-                    dynamic_key = f"sort_{m['id']}_{st.session_state.config_updater}"
-                    sl = sort_items(fl, direction='vertical', key=dynamic_key)
-                    if st.button("💾 Valider l'ordre", key=f"sv_{m['id']}"):
-                         nl = [next(f for f in m['fields'] if f"{f['name']} [{f['type']}]" == l) for l in sl]
-                         supabase.table("collections").update({"fields": nl}).eq("id", m['id']).execute()
-                         st.success("Validé")
-                         st.session_state.config_updater += 1
-                         time.sleep(0.5)
-                         st.rerun()
-                    tr = st.multiselect("Supprimer :", [f['name'] for f in m['fields']], key=f"del_{m['id']}")
-                    if tr and st.button("Confirmer suppression", key=f"c_{m['id']}"):
-                        supabase.table("collections").update({"fields": [f for f in m['fields'] if f['name'] not in tr]}).eq("id", m['id']).execute()
-                        st.success("Supprimé")
-                        st.session_state.config_updater += 1
-                        time.sleep(0.5)
-                        st.rerun()
-                    if st.button("💀 Supprimer modèle", key=f"k_{m['id']}", type="primary"):
-                         supabase.table("collections").delete().eq("id", m['id']).execute()
-                         st.rerun()
-
-# ONGLET 4 : UTILISATEURS
-if "4. 👥 Utilisateurs" in tabs_list:
-    idx = tabs_list.index("4. 👥 Utilisateurs")
-    with tabs[idx]:
-        st.header("👥 Équipe")
-        with st.form("ua"):
-            ue, up = st.text_input("Email"), st.text_input("Pass", type="password")
-            ur = st.selectbox("Rôle", ["admin2", "user"] if MY_ROLE == "admin1" else ["user"])
-            if st.form_submit_button("Ajouter"):
-                res = supabase.auth.sign_up({"email": ue, "password": up})
-                supabase.table("profiles").insert({"id": res.user.id, "email": ue, "company_id": MY_COMPANY_ID, "role": ur, "full_name": ue.split('@')[0]}).execute()
-                st.rerun()
+            # Schémas chargés une fois par collection, pas une fois par dossier
+            col_map = {c['id']: c for c in a_cols}
+            act_names = {a['id']: a['name'] for a in m_acts}
+
+            # --- RECHERCHE & FILTRES ---
+            q_text = st.text_input("🔎 Rechercher", key="rec_q", placeholder='dupont   ville:lyon   "Raison sociale":acme')
+            with st.expander("Filtres"):
+                fa, fc, fd = st.columns(3)
+                f_acts = fa.multiselect("Activité", list(act_names), format_func=act_names.get, key="rec_f_act")
+                f_cols = fc.multiselect("Modèle", list(col_map), format_func=lambda c: f"{act_names.get(col_map[c]['activity_id'], '?')} / {col_map[c]['name']}", key="rec_f_col")
+                f_dates = fd.date_input("Créés entre", value=[], key="rec_f_dates")
+            scope = [c for c, m in col_map.items() if (not f_acts or m['activity_id'] in f_acts) and (not f_cols or c in f_cols)]
+            searching = bool(q_text.strip()) or len(f_dates) == 2
+
+            # --- EXPORT (périmètre = filtres activité / modèle) ---
+            with st.expander("📤 Export"):
+                fmts = {"CSV": "csv", "Parquet": "parquet", "ZIP (CSV + pièces jointes)": "zip"}
+                if not exporter.HAS_PARQUET: fmts.pop("Parquet")
+                ex_fmt = st.radio("Format", list(fmts), horizontal=True, key="ex_fmt")
+                st.caption(f"{len(scope)} modèle(s) : " + ", ".join(col_map[c]['name'] for c in scope))
+                if scope and st.button("Préparer l'export", key="ex_go"):
+                    submit_job("export", {"collections": [col_map[c] for c in scope], "fmt": fmts[ex_fmt], "company_id": MY_COMPANY_ID},
+                               f"Export {ex_fmt.split(' ')[0]} ({len(scope)} modèle(s))")
+                    rerun()
+                st.caption("Le fichier sera proposé au téléchargement dans le panneau **Tâches** de la barre latérale.")
+
+            if not scope:
+                page_rows, pg, has_next = [], 0, False
+            elif searching:
+                sig = (q_text, tuple(scope), tuple(f_dates))
+                if st.session_state.get('search_sig') != sig:
+                    st.session_state.search_sig, st.session_state.search_page = sig, 0
+                pg = st.session_state.search_page
+                field_names = {f['name'] for c in scope for f in col_map[c]['fields']}
+                page_rows, has_next = search.search_records(db, scope, q_text, field_names, f_dates, page=pg, page_size=PAGE_SIZE)
+            else:
+                brw = record_browser(scope)
+                pg = brw['page']
+                page_rows = brw['rows'][pg * PAGE_SIZE:(pg + 1) * PAGE_SIZE]
+                has_next = (pg + 1) * PAGE_SIZE < len(brw['rows']) or brw['has_more']
+
+            if page_rows:
+                start = pg * PAGE_SIZE
+                row_map = {x['id']: x for x in page_rows}
+                sel_id = st.selectbox("Choisir dossier", list(row_map), format_func=lambda i: f"👤 {row_map[i].get('nom') or 'Dossier'} | 📄 {col_map[row_map[i]['collection_id']]['name']} | #{i}")
+                cp, ci, cn = st.columns([1, 2, 1])
+                step = 0
+                if cp.button("◀ Précédent", disabled=pg == 0, use_container_width=True): step = -1
+                ci.caption(f"Page {pg + 1} — {'résultats' if searching else 'dossiers'} {start + 1} à {start + len(page_rows)}")
+                if cn.button("Suivant ▶", disabled=not has_next, use_container_width=True): step = 1
+                if step and searching:
+                    st.session_state.search_page += step
+                    rerun()
+                elif step:
+                    # Page suivante chargée à la demande, à partir du dernier (created_at, id) connu
+                    if step > 0 and start + 2 * PAGE_SIZE > len(brw['rows']) and brw['has_more']:
+                        last = brw['rows'][-1]
+                        rows, brw['has_more'] = fetch_records_page(list(brw['key']), (last['created_at'], last['id']))
+                        brw['rows'].extend(rows)
+                    brw['page'] += step
+                    rerun()
+                if sel_id: dossier_editor(sel_id, col_map)
+            else: st.info("Aucun résultat." if searching else "Aucun dossier.")
+
+# VUE 3 : CONFIGURATION
+FIELD_TYPES = ["Texte Court", "Texte Long", "SIRET", "Adresse", "Adresse Travaux", "Fichier/Image", "Section/Titre"]
+
+@fragment
+def new_model_editor(aid):
+    """Création d'un modèle : la composition de la liste de champs ne relance que ce fragment."""
+    with st.expander("➕ Créer Modèle"):
+        nm = st.text_input("Nom du modèle")
+        c1, c2, c3 = st.columns([3, 2, 1])
+        fn = c1.text_input("Nom champ", key="new_fn")
+        ft = c2.selectbox("Type", FIELD_TYPES, key="new_ft")
+        if c3.button("Ajouter à la liste", key="add_to_list"):
+            if "t" not in st.session_state: st.session_state.t = []
+            st.session_state.t.append({"name": fn, "type": ft})
+            rerun(scope="fragment")
+        if "t" in st.session_state and st.session_state.t:
+            st.write(st.session_state.t)
+            if st.button("💾 SAUVEGARDER"):
+                db.add_collection(aid, nm, st.session_state.t)
+                invalidate("collections", MY_COMPANY_ID)
+                st.session_state.t = []
+                st.toast("Créé !")
+                rerun()  # nouveau modèle dans la liste : rerun complet
+
+@fragment
+def model_editor(mid):
+    """Édition des champs d'un modèle existant ; seules les suppressions de modèle relancent la page."""
+    m = next((c for c in load_collections(MY_COMPANY_ID) if c['id'] == mid), None)
+    if not m: return
+    with st.expander(f"📝 Gérer {m['name']}"):
+        st.markdown("#### Ajouter un champ")
+        ca1, ca2, ca3 = st.columns([3, 2, 1])
+        new_field_name = ca1.text_input("Nom", key=f"n_{m['id']}")
+        new_field_type = ca2.selectbox("Type", FIELD_TYPES, key=f"t_{m['id']}")
+        if ca3.button("Ajouter", key=f"add_{m['id']}"):
+            if new_field_name:
+                nf = m['fields'] + [{"name": new_field_name, "type": new_field_type}]
+                db.update_collection(m['id'], nf)
+                invalidate("collections", MY_COMPANY_ID)
+                st.toast("Champ ajouté !")
+                st.session_state.config_updater += 1
+                rerun(scope="fragment")
+
         st.divider()
-        ul = supabase.table("profiles").select("*").eq("company_id", MY_COMPANY_ID).execute().data
-        if ul:
-            st.dataframe(pd.DataFrame(ul)[["email", "role"]], use_container_width=True)
-            for u in ul:
-                if u['id'] != st.session_state.user.id:
-                    if (MY_ROLE == "admin1") or (MY_ROLE == "admin2" and u['role'] == "user"):
-                        if st.button(f"🗑️ Supprimer {u['email']}", key=f"d_{u['id']}", type="secondary"):
-                            supabase.table("profiles").delete().eq("id", u['id']).execute()
-                            st.success("Supprimé")
-                            time.sleep(0.5)
-                            st.rerun()
+        st.markdown("#### Trier / Supprimer")
+        fl = [f"{f['name']} [{f['type']}]" for f in m['fields']]
+        dynamic_key = f"sort_{m['id']}_{st.session_state.config_updater}"
+        sl = sort_items(fl, direction='vertical', key=dynamic_key)
+        if st.button("💾 Valider l'ordre", key=f"sv_{m['id']}"):
+             nl = [next(f for f in m['fields'] if f"{f['name']} [{f['type']}]" == l) for l in sl]
+             db.update_collection(m['id'], nl)
+             invalidate("collections", MY_COMPANY_ID)
+             st.toast("Validé")
+             st.session_state.config_updater += 1
+             rerun(scope="fragment")
+        tr = st.multiselect("Supprimer :", [f['name'] for f in m['fields']], key=f"del_{m['id']}")
+        if tr and st.button("Confirmer suppression", key=f"c_{m['id']}"):
+            db.update_collection(m['id'], [f for f in m['fields'] if f['name'] not in tr])
+            invalidate("collections", MY_COMPANY_ID)
+            st.toast("Supprimé")
+            st.session_state.config_updater += 1
+            rerun(scope="fragment")
+        if st.button("💀 Supprimer modèle", key=f"k_{m['id']}", type="primary"):
+             db.delete_collection(m['id'])
+             invalidate("collections", MY_COMPANY_ID)
+             reset_record_browser()
+             rerun()
+
+def view_config():
+    metrics.mark("configuration")
+    st.header("⚙️ Configuration")
+    with st.form("na"):
+        n = st.text_input("Nouvelle activité")
+        if st.form_submit_button("Ajouter"):
+            db.add_activity(MY_COMPANY_ID, n)
+            invalidate("activities", MY_COMPANY_ID)
+            rerun()
+        
+    st.divider()
+    acts = load_activities(MY_COMPANY_ID)
+    if acts:
+        aid = next(a['id'] for a in acts if a['name'] == st.selectbox("Activité :", [a['name'] for a in acts]))
+        new_model_editor(aid)
+        for m in [c for c in load_collections(MY_COMPANY_ID) if c['activity_id'] == aid]:
+            model_editor(m['id'])
+
+# VUE 4 : UTILISATEURS
+def view_users():
+    metrics.mark("utilisateurs")
+    st.header("👥 Équipe")
+    with st.form("ua"):
+        ue, up = st.text_input("Email"), st.text_input("Pass", type="password")
+        ur = st.selectbox("Rôle", ["admin2", "user"] if MY_ROLE == "admin1" else ["user"])
+        if st.form_submit_button("Ajouter"):
+            new_user = db.sign_up(ue, up)
+            db.add_profile({"id": new_user.id, "email": ue, "company_id": MY_COMPANY_ID, "role": ur, "full_name": ue.split('@')[0]})
+            invalidate("profiles", MY_COMPANY_ID)
+            rerun()
+    st.divider()
+    ul = load_profiles(MY_COMPANY_ID)
+    if ul:
+        st.dataframe(ul, column_order=["email", "role"], use_container_width=True)
+        for u in ul:
+            if u['id'] != st.session_state.user.id:
+                if (MY_ROLE == "admin1") or (MY_ROLE == "admin2" and u['role'] == "user"):
+                    if st.button(f"🗑️ Supprimer {u['email']}", key=f"d_{u['id']}", type="secondary"):
+                        db.delete_profile(u['id'])
+                        profile_cache().pop(u['id'], None)
+                        invalidate("profiles", MY_COMPANY_ID)
+                        st.toast("Supprimé")
+                        rerun()
+
+VIEWS = {"1. 📝 Nouveau Dossier": view_creation, "2. 📂 Gestion des Dossiers": view_records,
+         "3. ⚙️ Configuration": view_config, "4. 👥 Utilisateurs": view_users}
+metrics.current().view = view
+VIEWS[view]()
+
+# Après la vue : une tâche qu'elle vient de lancer apparaît dès ce rerun
+with jobs_box: jobs_panel()
+
+# --- STATS CACHE (rerun courant) ---
+metrics.mark("pied")
+qr, qs = st.session_state.q_rerun, st.session_state.q_stats
+cache_box.caption(f"🗄️ Cache : {qr['hit']} requêtes évitées / {qr['hit'] + qr['miss']} ce rerun — {qs['hit']} / {qs['hit'] + qs['miss']} depuis la connexion")
+
+# --- PROFILAGE (rerun courant) ---
+run = metrics.end_rerun()
+if show_prof and run:
+    with prof_box:
+        p1, p2 = st.columns(2)
+        p1.metric("Rerun", f"{run.ms:.0f} ms")
+        p2.metric("Backend", f"{run.backend_ms:.0f} ms", f"{len(run.calls)} appels", delta_color="off")
+        st.caption(f"Reruns du processus : p50 {metrics.percentile(50) * 1000:.0f} ms — p95 {metrics.percentile(95) * 1000:.0f} ms")
+        secs = run.sections()
+        if secs:
+            st.dataframe([{"section": k, "ms": round(v["ms"], 1), "appels": v["calls"], "backend ms": round(v["backend_ms"], 1)} for k, v in secs.items()], use_container_width=True, hide_index=True)
+        if run.calls:
+            st.dataframe([{"op": c.op, "cible": c.target, "filtres": c.detail, "lignes": c.rows, "Ko": round(c.bytes / 1024, 1), "ms": round(c.ms, 1)} for c in run.slowest(15)], use_container_width=True, hide_index=True)